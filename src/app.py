@@ -1,84 +1,262 @@
 import streamlit as st
-import openai_client
-import time
+import backends
+import session_store
+import metrics
+import generation_jobs
+import participants
 import os
+import uuid
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Session details persisted alongside the messages
+SESSION_FIELDS = ("current_speaker_id", "custom_names_set", "room_id")
+
+# Number of chat messages rendered per page; older ones load on demand
+RENDER_WINDOW = int(os.getenv("RENDER_WINDOW", "30"))
+
+# Seconds to wait for a finished reply to reach the session store before moving on
+REPLY_SAVE_TIMEOUT = float(os.getenv("REPLY_SAVE_TIMEOUT", "10"))
+
+# Show per-turn timings in the sidebar; also enabled per session with ?debug=1
+DEBUG_PANEL = os.getenv("DEBUG_PANEL", "").lower() in ("1", "true", "yes")
+
+SESSION_INSTRUCTIONS = """
+### Welcome to AI Roommates Therapy
+This is a safe space for roommates to discuss living arrangement issues with the guidance of an AI therapist.
+- Each roommate takes turns speaking with the AI therapist
+- The AI will recognize who is speaking and maintain context
+- Discuss household responsibilities, shared spaces, noise levels, and other common roommate concerns
+- Be honest, respectful, and open to feedback
+"""
+
+# Custom CSS for better button styling, built once at import: one colour per seat
+TOGGLE_CSS = "<style>" + "".join(f"""
+/* Style for the {avatar} speaker button */
+div[data-testid="stButton"] > button[kind="secondary"][data-testid="speaker_button_p{seat + 1}"] {{
+    background-color: transparent;
+    color: {color};
+    border: 2px solid {color};
+    border-radius: 12px;
+}}
+div[data-testid="stButton"] > button[kind="primary"][data-testid="speaker_button_p{seat + 1}"] {{
+    background-color: {color};
+    border: none;
+    border-radius: 12px;
+}}
+""" for seat, (avatar, color) in enumerate(participants.SEATS)) + """
+/* Hover effects for all buttons */
+div[data-testid="stButton"] > button:hover {
+    box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
+    transform: translateY(-1px);
+}
+</style>
+"""
+
 def initialize_session():
+    if "session_id" not in st.session_state:
+        # Keep the session ID in the URL so a reconnect, or another replica, can resume it
+        session_id = st.query_params.get("session")
+        if not session_id:
+            session_id = uuid.uuid4().hex
+            st.query_params["session"] = session_id
+        st.session_state.session_id = session_id
+        
+        # Restore a previous session, loading only its most recent messages
+        store = session_store.get_store()
+        info = store.load_session(session_id) or {}
+        for field in SESSION_FIELDS:
+            if field in info:
+                st.session_state[field] = info[field]
+        st.session_state.participants = participants.ParticipantRegistry.from_session_info(info)
+        if "current_speaker_id" not in info and "current_speaker" in info:
+            # Sessions saved before participant IDs stored the speaker's name
+            for participant in st.session_state.participants:
+                if participant["name"] == info["current_speaker"]:
+                    st.session_state.current_speaker_id = participant["id"]
+        st.session_state.messages = store.load_recent(session_id)
+        # A full window means the store may hold older messages
+        st.session_state.history_exhausted = len(st.session_state.messages) < session_store.SESSION_WINDOW
     if "messages" not in st.session_state:
         st.session_state.messages = []
-    if "current_speaker" not in st.session_state:
-        st.session_state.current_speaker = "Roommate 1"
-    if "roommate1_name" not in st.session_state:
-        st.session_state.roommate1_name = "Roommate 1"
-    if "roommate2_name" not in st.session_state:
-        st.session_state.roommate2_name = "Roommate 2"
+    if "participants" not in st.session_state:
+        st.session_state.participants = participants.ParticipantRegistry.default()
+    if st.session_state.get("current_speaker_id") not in st.session_state.participants.ids():
+        st.session_state.current_speaker_id = st.session_state.participants.ids()[0]
+    if "room_id" not in st.session_state:
+        # Sessions of the same household share a room, e.g. ?room=house-12; otherwise each is its own
+        st.session_state.room_id = st.query_params.get("room") or st.session_state.session_id
     if "custom_names_set" not in st.session_state:
         st.session_state.custom_names_set = False
+    if "earlier_messages" not in st.session_state:
+        # Older messages fetched for display only; never fed back to the model
+        st.session_state.earlier_messages = []
+    if "history_exhausted" not in st.session_state:
+        st.session_state.history_exhausted = True
+    if "visible_messages" not in st.session_state:
+        st.session_state.visible_messages = RENDER_WINDOW
+    if "therapy_context" not in st.session_state:
+        st.session_state.therapy_context = backends.get_backend().new_context()
+    if "pending_turn" not in st.session_state:
+        # A reply may still be generating from before a reconnect
+        job = generation_jobs.get_queue().latest(st.session_state.session_id)
+        # The user message carries the same turn ID, so only a stored reply counts
+        replied = job is not None and any(
+            m.get("role") == "assistant" and m.get("turn") == job.turn_id for m in st.session_state.messages
+        )
+        st.session_state.pending_turn = job.turn_id if job is not None and not replied else None
+
+def save_session_info():
+    info = {field: st.session_state[field] for field in SESSION_FIELDS}
+    info["participants"] = st.session_state.participants.to_list()
+    session_store.get_store().save_session(st.session_state.session_id, info)
+
+def current_speaker():
+    """Return the participant record of whoever is speaking now"""
+    return st.session_state.participants.get(st.session_state.current_speaker_id)
+
+def append_message(message):
+    """Add a message to the chat history and queue it for the session store"""
+    st.session_state.messages.append(message)
+    session_store.get_store().append(st.session_state.session_id, message)
+
+def load_earlier_messages():
+    """Fetch the page of messages before the oldest one already loaded"""
+    loaded = st.session_state.earlier_messages or st.session_state.messages
+    oldest_id = loaded[0].get("id") if loaded else None
+    if oldest_id is None:
+        st.session_state.history_exhausted = True
+        return
+    
+    older = session_store.get_store().load_before(st.session_state.session_id, oldest_id, RENDER_WINDOW)
+    st.session_state.earlier_messages = older + st.session_state.earlier_messages
+    if len(older) < RENDER_WINDOW:
+        st.session_state.history_exhausted = True
+
+def render_message(message):
+    # The avatar is resolved once, when the message is appended
+    with st.chat_message(message["role"], avatar=message.get("avatar")):
+        st.markdown(message["content"])
+
+def render_history():
+    """Render the most recent page of messages, with a button to page further back"""
+    messages = st.session_state.messages
+    earlier = st.session_state.earlier_messages
+    loaded = len(earlier) + len(messages)
+    
+    if st.session_state.visible_messages < loaded or not st.session_state.history_exhausted:
+        if st.button("Load earlier messages", key="load_earlier_button"):
+            st.session_state.visible_messages += RENDER_WINDOW
+            if st.session_state.visible_messages > loaded and not st.session_state.history_exhausted:
+                load_earlier_messages()
+                earlier = st.session_state.earlier_messages
+    
+    visible = st.session_state.visible_messages
+    if visible > len(messages):
+        for message in earlier[max(len(earlier) - (visible - len(messages)), 0):]:
+            render_message(message)
+        visible = len(messages)
+    for message in messages[len(messages) - visible:]:
+        render_message(message)
+
+def save_reply(job):
+    """Persist a finished reply from the generation worker, even if no script run is watching"""
+    store = session_store.get_store()
+    store.append(job.session_id, {"role": "assistant", "avatar": "🧠", "content": job.text(), "turn": job.turn_id})
+    with metrics.span("turn.persist"):
+        store.flush()
+
+def render_pending_turn():
+    """Follow the reply being generated for this session, then add it to the chat history"""
+    job = generation_jobs.get_queue().get(st.session_state.session_id, st.session_state.pending_turn)
+    if job is None:
+        st.session_state.pending_turn = None
+        return
+    
+    with st.chat_message("assistant", avatar="🧠"):
+        message_placeholder = st.empty()
+        message_placeholder.markdown("▌")
+        
+        # Render tokens as the worker streams them; a rerun picks up where this one left off
+        for text in job.follow():
+            message_placeholder.markdown(text + ("" if job.done else "▌"))
+        message_placeholder.markdown(job.text())
+    
+    # The worker stores the reply; wait for it so a following user message is stored after it
+    job.wait_saved(REPLY_SAVE_TIMEOUT)
+    # Only the in-memory history still needs it
+    st.session_state.messages.append({"role": "assistant", "avatar": "🧠", "content": job.text(), "turn": job.turn_id})
+    st.session_state.pending_turn = None
+
+def render_debug_panel():
+    """Sidebar with this session's recent stage timings and the process-wide percentiles"""
+    if not (DEBUG_PANEL or st.query_params.get("debug") == "1"):
+        return
+    with st.sidebar:
+        st.markdown("### ⏱️ Timings")
+        spans = metrics.session_spans(st.session_state.session_id)
+        if spans:
+            st.table([{"stage": stage, "ms": round(seconds * 1000, 1)} for stage, seconds, _ in spans[-20:]])
+        data = metrics.snapshot()
+        st.markdown("#### All sessions (ms)")
+        st.table([
+            {"stage": stage, "count": entry["count"],
+             **{key: round(entry[key] * 1000, 1) for key in ("p50", "p95", "p99") if key in entry}}
+            for stage, entry in data["stages"].items()
+        ])
+        if data["counters"]:
+            st.json(data["counters"])
+        st.markdown("#### Rooms")
+        st.json(generation_jobs.get_queue().scheduler.stats())
 
 def switch_speaker():
-    if st.session_state.current_speaker == st.session_state.roommate1_name:
-        st.session_state.current_speaker = st.session_state.roommate2_name
-    else:
-        st.session_state.current_speaker = st.session_state.roommate1_name
+    st.session_state.current_speaker_id = st.session_state.participants.next_id(st.session_state.current_speaker_id)
+    save_session_info()
 
 def main():
     st.title("AI Roommates Therapy")
     
     initialize_session()
+    metrics.serve()
+    metrics.set_session(st.session_state.session_id)
     
     # Display session instructions
-    st.markdown("""
-    ### Welcome to AI Roommates Therapy
-    This is a safe space for roommates to discuss living arrangement issues with the guidance of an AI therapist.
-    - Each roommate takes turns speaking with the AI therapist
-    - The AI will recognize who is speaking and maintain context
-    - Discuss household responsibilities, shared spaces, noise levels, and other common roommate concerns
-    - Be honest, respectful, and open to feedback
-    """)
+    st.markdown(SESSION_INSTRUCTIONS)
     
     # Display chat messages
-    for message in st.session_state.messages:
-        if message["role"] == "assistant":
-            # For the AI therapist, use the brain emoji
-            with st.chat_message(message["role"], avatar="🧠"):
-                st.markdown(message["content"])
-        else:
-            # For user messages, use colored circle emojis
-            # Determine which roommate is speaking
-            if message["content"].startswith(f"**{st.session_state.roommate1_name}"):
-                avatar = "🔴"  # Red circle for roommate 1
-            else:
-                avatar = "🔵"  # Blue circle for roommate 2
-                
-            # Display the message with the colored circle emoji
-            with st.chat_message(message["role"], avatar=avatar):
-                st.markdown(message["content"])
+    render_history()
     
     # Add AI therapist's introduction if this is the start of the conversation
     if not st.session_state.messages:
         therapist_intro = "Hello, I'm your AI therapist specializing in roommate relationships. I'm here to help you navigate common living arrangement challenges and improve your home environment. Who would like to start by sharing what roommate issue brings you here today?"
-        st.session_state.messages.append({"role": "assistant", "avatar": "🧠", "content": therapist_intro})
+        append_message({"role": "assistant", "avatar": "🧠", "content": therapist_intro})
+        session_store.get_store().flush()
         with st.chat_message("assistant", avatar="🧠"):
             st.markdown(therapist_intro)
     
     # Custom name and color input form (only shown at the beginning)
+    registry = st.session_state.participants
     if not st.session_state.custom_names_set:
         st.markdown("### 🏠 Customize Your Roommate Profiles")
+        # Outside the form so the name fields follow the count straight away
+        count = st.number_input(
+            "How many roommates?",
+            min_value=participants.MIN_PARTICIPANTS,
+            max_value=participants.MAX_PARTICIPANTS,
+            value=max(len(registry), participants.MIN_PARTICIPANTS),
+            key="participant_count_input"
+        )
         with st.form(key="roommate_profiles_form"):
-            # First roommate settings
-            col1, col2 = st.columns(2)
-            with col1:
-                st.markdown("<h3 style='text-align:center;'>🔴 First Roommate</h3>", unsafe_allow_html=True)
-                roommate1 = st.text_input("Name", value=st.session_state.roommate1_name, key="roommate1_name_input")
-                
-            # Second roommate settings
-            with col2:
-                st.markdown("<h3 style='text-align:center;'>🔵 Second Roommate</h3>", unsafe_allow_html=True)
-                roommate2 = st.text_input("Name", value=st.session_state.roommate2_name, key="roommate2_name_input")
+            names = []
+            columns = st.columns(min(count, 3))
+            for seat in range(count):
+                avatar = participants.SEATS[seat][0]
+                default = registry.participants[seat]["name"] if seat < len(registry) else f"Roommate {seat + 1}"
+                with columns[seat % len(columns)]:
+                    st.markdown(f"<h3 style='text-align:center;'>{avatar} Roommate {seat + 1}</h3>", unsafe_allow_html=True)
+                    names.append(st.text_input("Name", value=default, key=f"participant_name_input_{seat}"))
             
             # Add some spacing
             st.write("")
@@ -87,134 +265,72 @@ def main():
             submit_button = st.form_submit_button(label="Save Profiles", use_container_width=True)
             
             if submit_button:
-                if roommate1 and roommate2:
-                    st.session_state.roommate1_name = roommate1
-                    st.session_state.roommate2_name = roommate2
-                    st.session_state.current_speaker = roommate1
+                if all(names) and len(set(names)) == len(names):
+                    registry.set_names(names)
+                    st.session_state.current_speaker_id = registry.ids()[0]
                     st.session_state.custom_names_set = True
+                    save_session_info()
                     st.experimental_rerun()
                 else:
-                    st.error("Please enter names for both roommates.")
+                    st.error("Please enter a different name for each roommate.")
     
     # Modern speaker toggle
     st.markdown("### 🎙️ Who's Speaking Now?")
+    st.markdown(TOGGLE_CSS, unsafe_allow_html=True)
     
-    # Custom CSS for better button styling
-    st.markdown("""
-    <style>
-    /* Style for the red speaker button (left) */
-    div[data-testid="stButton"] > button[kind="secondary"][data-testid="roommate1_button"] {
-        background-color: transparent;
-        color: #ff5252;
-        border: 2px solid #ff5252;
-        border-radius: 12px;
-    }
-    div[data-testid="stButton"] > button[kind="primary"][data-testid="roommate1_button"] {
-        background-color: #ff5252;
-        border: none;
-        border-radius: 12px;
-    }
-    
-    /* Style for the blue speaker button (right) */
-    div[data-testid="stButton"] > button[kind="secondary"][data-testid="roommate2_button"] {
-        background-color: transparent;
-        color: #3b82f6;
-        border: 2px solid #3b82f6;
-        border-radius: 12px;
-    }
-    div[data-testid="stButton"] > button[kind="primary"][data-testid="roommate2_button"] {
-        background-color: #3b82f6;
-        border: none;
-        border-radius: 12px;
-    }
-    
-    /* Hover effects for all buttons */
-    div[data-testid="stButton"] > button:hover {
-        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-        transform: translateY(-1px);
-    }
-    </style>
-    """, unsafe_allow_html=True)
-    
-    # Create a modern toggle with custom styling
-    col1, col2, col3 = st.columns([1, 3, 1])
-    
-    with col1:
-        st.write("")
-    
-    with col2:
-        # Determine which roommate is active
-        roommate1_active = st.session_state.current_speaker == st.session_state.roommate1_name
-        roommate2_active = st.session_state.current_speaker == st.session_state.roommate2_name
-        
-        # We'll keep the emojis for the chat but not for the toggle buttons
-        
-        # Set button styles based on active state
-        roommate1_style = "primary" if roommate1_active else "secondary"
-        roommate2_style = "primary" if roommate2_active else "secondary"
-        
-        # Create the toggle buttons with Streamlit's native buttons
-        toggle_cols = st.columns([5, 1, 5])
-        
-        with toggle_cols[0]:
-            if st.button(f"{st.session_state.roommate1_name}", type=roommate1_style, use_container_width=True, key="roommate1_button"):
-                if not roommate1_active:
-                    st.session_state.current_speaker = st.session_state.roommate1_name
-                    st.experimental_rerun()
-        
-        with toggle_cols[1]:
-            st.write("")
-            
-        with toggle_cols[2]:
-            if st.button(f"{st.session_state.roommate2_name}", type=roommate2_style, use_container_width=True, key="roommate2_button"):
-                if not roommate2_active:
-                    st.session_state.current_speaker = st.session_state.roommate2_name
+    # One button per roommate; the active one is highlighted in their colour
+    toggle_cols = st.columns(len(registry))
+    for column, participant in zip(toggle_cols, registry):
+        active = participant["id"] == st.session_state.current_speaker_id
+        with column:
+            if st.button(participant["name"], type="primary" if active else "secondary", use_container_width=True, key=f"speaker_button_{participant['id']}"):
+                if not active:
+                    st.session_state.current_speaker_id = participant["id"]
+                    save_session_info()
                     st.experimental_rerun()
     
-    with col3:
-        st.write("")
+    # Finish the reply to the previous turn first, so a message sent while it was
+    # still generating lands after it in the history and in the model's context
+    if st.session_state.pending_turn:
+        render_pending_turn()
     
     # Get user text input with personalized placeholder
-    if prompt := st.chat_input(f"Type your message as {st.session_state.current_speaker}..."):
+    if prompt := st.chat_input(f"Type your message as {current_speaker()['name']}..."):
         # Add user message to chat history
-        speaker = st.session_state.current_speaker
-        
-        # Use colored circle emojis based on roommate
-        if speaker == st.session_state.roommate1_name:
-            # Map custom color to closest standard emoji color
-            avatar = "🔴"  # Red circle for roommate 1
-        else:
-            avatar = "🔵"  # Blue circle for roommate 2
+        participant = current_speaker()
+        speaker = participant["name"]
+        avatar = participant["avatar"]
         
         user_message = f"**{speaker}**: {prompt}"
-        st.session_state.messages.append({"role": "user", "avatar": avatar, "content": user_message})
+        turn_id = uuid.uuid4().hex
+        append_message({
+            "role": "user", "avatar": avatar, "speaker": speaker, "speaker_id": participant["id"],
+            "content": user_message, "turn": turn_id
+        })
         
         # Display user message
         with st.chat_message("user", avatar=avatar):
             st.markdown(user_message)
         
         # Prepare context for the AI model
-        formatted_messages = openai_client.prepare_therapy_context(st.session_state.messages, st.session_state.current_speaker)
-        
-        # Get AI response
-        with st.chat_message("assistant", avatar="🧠"):
-            message_placeholder = st.empty()
-            full_response = ""
-            
-            # Simulate stream of response with a spinner
-            with st.spinner("Therapist is thinking..."):
-                response = openai_client.get_response(formatted_messages)
-            
-            # Display the response word by word
-            for chunk in response.split():
-                full_response += chunk + " "
-                time.sleep(0.05)
-                message_placeholder.markdown(full_response + "▌")
-            
-            message_placeholder.markdown(response)
+        backend = backends.get_backend()
+        with metrics.span("turn.prepare_context"):
+            formatted_messages = backend.prepare_context(
+                st.session_state.messages,
+                speaker,
+                context=st.session_state.therapy_context
+            )
         
-        # Add assistant response to chat history
-        st.session_state.messages.append({"role": "assistant", "avatar": "🧠", "content": response})
+        # Generate in the background so a rerun or reconnect doesn't lose the reply
+        session_store.get_store().flush()
+        generation_jobs.get_queue().submit(
+            st.session_state.session_id, turn_id, backend, formatted_messages,
+            on_complete=save_reply, room_id=st.session_state.room_id
+        )
+        st.session_state.pending_turn = turn_id
+        render_pending_turn()
+    
+    render_debug_panel()
 
 if __name__ == "__main__":
     main()
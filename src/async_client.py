@@ -0,0 +1,243 @@
+import os
+import json
+import asyncio
+import threading
+import httpx
+import http_transport
+import openai_client
+import ollama_client
+import prompt_templates
+
+# Maximum in-flight requests per backend kind
+CONCURRENCY_LIMITS = {
+    "openai": int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")),
+    "ollama": int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2")),
+}
+
+# Backends raced by race_response, in launch order
+RACE_BACKENDS = [b.strip() for b in os.getenv("LLM_RACE_BACKENDS", "ollama,openai").split(",") if b.strip()]
+
+# Seconds to give each backend before hedging to the next one; 0 races them all at once
+HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "0"))
+
+ENDPOINTS = {
+    "openai": openai_client.API_URL,
+    "ollama": ollama_client.OLLAMA_API_URL,
+}
+
+# Extra Ollama replicas, e.g. OLLAMA_REPLICA_URLS=http://gpu-1:11434/api/chat,http://gpu-2:11434/api/chat
+# They are registered as "ollama-1", "ollama-2", ...
+for _i, _url in enumerate([u.strip() for u in os.getenv("OLLAMA_REPLICA_URLS", "").split(",") if u.strip()], start=1):
+    ENDPOINTS[f"ollama-{_i}"] = _url
+
+_loop = None
+_client = None
+_semaphores = {}
+_lock = threading.Lock()
+
+
+def _kind(backend):
+    """Return "openai" or "ollama" for a backend name such as "ollama-2" """
+    return "ollama" if backend.startswith("ollama") else "openai"
+
+
+def _client_module(backend):
+    return ollama_client if _kind(backend) == "ollama" else openai_client
+
+
+def _get_loop():
+    """Return the shared event loop, starting its thread on first use"""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-async-loop", daemon=True).start()
+        return _loop
+
+
+def run(coro):
+    """
+    Run a coroutine on the shared event loop and wait for its result.
+    Lets synchronous code such as Streamlit script threads share one
+    async connection pool.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+def _get_client():
+    """Return the shared async HTTP client (must be called on the shared loop)"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(http_transport.READ_TIMEOUT, connect=http_transport.CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=http_transport.POOL_SIZE * len(ENDPOINTS),
+                max_keepalive_connections=http_transport.POOL_SIZE * len(ENDPOINTS)
+            )
+        )
+    return _client
+
+
+def _get_semaphore(backend):
+    if backend not in _semaphores:
+        _semaphores[backend] = asyncio.Semaphore(CONCURRENCY_LIMITS[_kind(backend)])
+    return _semaphores[backend]
+
+
+def _build_request(backend, prompt, stream=False):
+    """Return the headers and payload for a backend, matching the synchronous clients"""
+    if _kind(backend) == "ollama":
+        headers = dict(ollama_client.JSON_HEADERS)
+        payload = ollama_client.request_fingerprint(prompt)
+        payload["stream"] = stream
+    else:
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {openai_client.API_KEY}"
+        }
+        payload = openai_client.request_fingerprint(prompt)
+        if stream:
+            payload["stream"] = True
+    return headers, payload
+
+
+async def _complete(backend, prompt):
+    """Request a full completion, raising on errors. Shares breakers and retry policy with http_transport."""
+    breaker = http_transport.get_breaker(backend)
+    if not breaker.allow_request():
+        raise http_transport.CircuitOpenError(f"{backend} backend is unavailable, circuit breaker is open")
+
+    headers, payload = _build_request(backend, prompt)
+    body = prompt_templates.render_body(payload)
+    async with _get_semaphore(backend):
+        for attempt in range(http_transport.MAX_RETRIES + 1):
+            try:
+                response = await _get_client().post(ENDPOINTS[backend], headers=headers, content=body)
+            except (httpx.ConnectError, httpx.TimeoutException):
+                if attempt == http_transport.MAX_RETRIES:
+                    breaker.record_failure()
+                    raise
+                await asyncio.sleep(http_transport.retry_delay(attempt))
+                continue
+
+            if response.status_code in http_transport.RETRY_STATUS_CODES:
+                if attempt < http_transport.MAX_RETRIES:
+                    await asyncio.sleep(http_transport.retry_delay(attempt, response))
+                    continue
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            break
+
+    response.raise_for_status()
+    data = response.json()
+    if _kind(backend) == "ollama":
+        ollama_client.record_timings(data)
+        return data["message"]["content"]
+    return data["choices"][0]["message"]["content"]
+
+
+async def get_response(prompt, backend="openai"):
+    """
+    Async counterpart of openai_client.get_response / ollama_client.get_response.
+    The prompt must be prepared by the matching module's prepare_therapy_context.
+    """
+    try:
+        return await _complete(backend, prompt)
+    except (httpx.HTTPError, http_transport.CircuitOpenError) as e:
+        return f"Error communicating with {backend}: {str(e)}"
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        return f"Error processing {backend} response: {str(e)}"
+
+
+async def stream_response(prompt, backend="openai"):
+    """Async counterpart of the clients' stream_response, yielding tokens as they arrive"""
+    breaker = http_transport.get_breaker(backend)
+    if not breaker.allow_request():
+        yield f"Error communicating with {backend}: circuit breaker is open"
+        return
+
+    headers, payload = _build_request(backend, prompt, stream=True)
+    body = prompt_templates.render_body(payload)
+    # The breaker hears about each request once, by the same rules as http_transport.post:
+    # retryable statuses and connection failures count against it, any other response for it
+    counted = False
+    try:
+        async with _get_semaphore(backend):
+            async with _get_client().stream("POST", ENDPOINTS[backend], headers=headers, content=body) as response:
+                if response.status_code in http_transport.RETRY_STATUS_CODES:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                counted = True
+                response.raise_for_status()
+
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    if _kind(backend) == "ollama":
+                        # Newline-delimited JSON chunks
+                        chunk = json.loads(line)
+                        token = chunk.get("message", {}).get("content")
+                        if token:
+                            yield token
+                        if chunk.get("done"):
+                            ollama_client.record_timings(chunk)
+                            break
+                    else:
+                        # Server-sent events
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        token = json.loads(data)["choices"][0]["delta"].get("content")
+                        if token:
+                            yield token
+    except httpx.HTTPError as e:
+        if not counted and isinstance(e, (httpx.ConnectError, httpx.TimeoutException)):
+            breaker.record_failure()
+        yield f"Error communicating with {backend}: {str(e)}"
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        yield f"Error processing {backend} response: {str(e)}"
+
+
+async def race_response(messages, current_speaker, backends=None, hedge_delay=HEDGE_DELAY):
+    """
+    Send the same conversation to several backends and return the first good
+    response, cancelling the rest.
+
+    With hedge_delay=0 all backends are started at once (race). Otherwise each
+    backend gets hedge_delay seconds before the next one is started (hedged
+    request); a failure starts the next backend immediately.
+    """
+    backends = backends or RACE_BACKENDS
+    pending = set()
+    errors = []
+    try:
+        for i, backend in enumerate(backends):
+            prompt = _client_module(backend).prepare_therapy_context(messages, current_speaker)
+            pending.add(asyncio.create_task(_complete(backend, prompt), name=backend))
+
+            is_last = i == len(backends) - 1
+            if not is_last and not hedge_delay:
+                continue
+
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=None if is_last else hedge_delay,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(f"{task.get_name()}: {task.exception()}")
+                # Hedge delay elapsed or a backend failed: bring in the next one
+                if not is_last:
+                    break
+
+        return "Error: no backend returned a response (" + "; ".join(errors) + ")"
+    finally:
+        for task in pending:
+            task.cancel()
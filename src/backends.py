@@ -0,0 +1,289 @@
+import os
+import time
+import threading
+import openai_client
+import ollama_client
+import response_cache
+import summarizer
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Comma-separated backend names in failover order, e.g. "ollama,openai"
+BACKEND_NAMES = [b.strip() for b in os.getenv("LLM_BACKENDS", "openai").split(",") if b.strip()]
+
+# Skip a backend while its smoothed latency (seconds) is above this; 0 disables the check
+LATENCY_THRESHOLD = float(os.getenv("LLM_LATENCY_THRESHOLD", "0"))
+# Skip a backend while it has this many requests in flight; 0 means unlimited
+MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "0"))
+# After this many seconds without a measurement a slow backend gets another try
+LATENCY_RECHECK = 30.0
+# Weight of the newest sample in the latency moving average
+LATENCY_SMOOTHING = 0.3
+
+
+class BackendUnavailableError(Exception):
+    """Raised when every backend in a failover chain has failed"""
+
+
+class LLMBackend:
+    """
+    Common interface over the LLM client modules.
+
+    Subclasses set `client` to a module providing new_context,
+    prepare_therapy_context, fetch_response and iter_response. The backend
+    also tracks in-flight requests and a smoothed latency so a failover
+    chain can shed load away from it.
+    """
+
+    name = None
+    client = None
+
+    def __init__(self):
+        self.inflight = 0
+        self.latency = None
+        self.measured_at = 0.0
+        self.lock = threading.Lock()
+
+    def new_context(self, summarize=True, rolling_summary=None):
+        """Create the per-session incremental context for this backend"""
+        return self.client.new_context(summarize=summarize, rolling_summary=rolling_summary)
+
+    def prepare_context(self, messages, current_speaker, context=None):
+        """Build the backend-specific prompt for the next turn"""
+        return self.client.prepare_therapy_context(messages, current_speaker, context=context)
+
+    def summarize(self, prompt):
+        """Answer a standalone text prompt, as used for rolling summaries"""
+        return self.client.complete(prompt)
+
+    def complete(self, prompt):
+        """Return the full response text, raising on errors"""
+        self._begin()
+        start = time.monotonic()
+        try:
+            return self.client.fetch_response(prompt)
+        finally:
+            self._end(time.monotonic() - start)
+
+    def stream(self, prompt):
+        """Yield response tokens as they arrive, raising on errors"""
+        self._begin()
+        start = time.monotonic()
+        elapsed = None
+        try:
+            for token in self.client.iter_response(prompt):
+                if elapsed is None:
+                    # Time to first token is what the user feels
+                    elapsed = time.monotonic() - start
+                yield token
+        finally:
+            self._end(elapsed if elapsed is not None else time.monotonic() - start)
+
+    def stream_response(self, prompt):
+        """Like stream, but errors are yielded as text for display in the chat"""
+        try:
+            yield from self.stream(prompt)
+        except Exception as e:
+            yield f"Error communicating with the language model: {str(e)}"
+
+    def cache_key(self, prompt):
+        """Return the response cache key for a prepared prompt"""
+        return response_cache.make_key({"backend": self.name, "request": self.client.request_fingerprint(prompt)})
+
+    def is_available(self):
+        """Return False while the backend is saturated or too slow"""
+        with self.lock:
+            if MAX_INFLIGHT and self.inflight >= MAX_INFLIGHT:
+                return False
+            if LATENCY_THRESHOLD and self.latency is not None and self.latency > LATENCY_THRESHOLD:
+                return time.monotonic() - self.measured_at > LATENCY_RECHECK
+            return True
+
+    def _begin(self):
+        with self.lock:
+            self.inflight += 1
+
+    def _end(self, elapsed):
+        with self.lock:
+            self.inflight -= 1
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency = LATENCY_SMOOTHING * elapsed + (1 - LATENCY_SMOOTHING) * self.latency
+            self.measured_at = time.monotonic()
+
+
+class OpenAIBackend(LLMBackend):
+    name = "openai"
+    client = openai_client
+
+
+class OllamaBackend(LLMBackend):
+    name = "ollama"
+    client = ollama_client
+
+
+class FailoverBackend(LLMBackend):
+    """
+    Tries a list of backends in order, moving on when one fails, is
+    saturated, or is over the latency threshold. Contexts and prompts are
+    dicts keyed by backend name since each backend has its own format.
+    """
+
+    def __init__(self, backends):
+        super().__init__()
+        self.backends = backends
+        self.name = ",".join(backend.name for backend in backends)
+
+    def new_context(self, summarize=True, rolling_summary=None):
+        # One summarizer serves every backend's context, so older turns are
+        # summarized once, by whichever backend is currently preferred
+        if rolling_summary is None and summarize and summarizer.summarization_enabled():
+            rolling_summary = summarizer.RollingSummarizer(self.summarize)
+        return {
+            backend.name: backend.new_context(summarize=False, rolling_summary=rolling_summary)
+            for backend in self.backends
+        }
+
+    def prepare_context(self, messages, current_speaker, context=None):
+        context = context or {}
+        return {
+            backend.name: backend.prepare_context(messages, current_speaker, context=context.get(backend.name))
+            for backend in self.backends
+        }
+
+    def _candidates(self):
+        """Available backends first, then the rest as a last resort"""
+        available = [backend for backend in self.backends if backend.is_available()]
+        return available + [backend for backend in self.backends if backend not in available]
+
+    def summarize(self, prompt):
+        errors = []
+        for backend in self._candidates():
+            try:
+                return backend.summarize(prompt)
+            except Exception as e:
+                errors.append(f"{backend.name}: {e}")
+        raise BackendUnavailableError("; ".join(errors))
+
+    def complete(self, prompt):
+        errors = []
+        for backend in self._candidates():
+            try:
+                return backend.complete(prompt[backend.name])
+            except Exception as e:
+                errors.append(f"{backend.name}: {e}")
+        raise BackendUnavailableError("; ".join(errors))
+
+    def stream(self, prompt):
+        errors = []
+        for backend in self._candidates():
+            tokens = backend.stream(prompt[backend.name])
+            # Fail over only before the first token; after that the reply is committed
+            try:
+                first = next(tokens)
+            except StopIteration:
+                return
+            except Exception as e:
+                errors.append(f"{backend.name}: {e}")
+                continue
+            yield first
+            yield from tokens
+            return
+        raise BackendUnavailableError("; ".join(errors))
+
+    def cache_key(self, prompt):
+        return response_cache.make_key([backend.cache_key(prompt[backend.name]) for backend in self.backends])
+
+    def is_available(self):
+        return any(backend.is_available() for backend in self.backends)
+
+
+class CachedBackend(LLMBackend):
+    """
+    Serves repeated requests from a ResponseCache in front of another
+    backend. Only complete, successful responses are stored.
+    """
+
+    def __init__(self, backend, cache):
+        super().__init__()
+        self.backend = backend
+        self.cache = cache
+        self.name = backend.name
+
+    def new_context(self, summarize=True, rolling_summary=None):
+        return self.backend.new_context(summarize=summarize, rolling_summary=rolling_summary)
+
+    def summarize(self, prompt):
+        return self.backend.summarize(prompt)
+
+    def prepare_context(self, messages, current_speaker, context=None):
+        return self.backend.prepare_context(messages, current_speaker, context=context)
+
+    def complete(self, prompt):
+        key = self.backend.cache_key(prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        response = self.backend.complete(prompt)
+        self.cache.set(key, response)
+        return response
+
+    def stream(self, prompt):
+        key = self.backend.cache_key(prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        tokens = []
+        for token in self.backend.stream(prompt):
+            tokens.append(token)
+            yield token
+        # Reached only if the stream finished without raising
+        self.cache.set(key, "".join(tokens))
+
+    def cache_key(self, prompt):
+        return self.backend.cache_key(prompt)
+
+    def is_available(self):
+        return self.backend.is_available()
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "ollama": OllamaBackend,
+}
+
+_backend = None
+_lock = threading.Lock()
+
+
+def register_backend(name, backend_class):
+    """Make a custom LLMBackend subclass selectable through LLM_BACKENDS"""
+    BACKENDS[name] = backend_class
+
+
+def create_backend(names):
+    """
+    Create a backend from a list of names, wrapping several in a failover
+    chain and putting the response cache in front unless it is disabled.
+    """
+    unknown = [name for name in names if name not in BACKENDS]
+    if unknown:
+        raise ValueError(f"Unknown LLM backend(s): {', '.join(unknown)}")
+    backends = [BACKENDS[name]() for name in names]
+    backend = backends[0] if len(backends) == 1 else FailoverBackend(backends)
+    if response_cache.CACHE_ENABLED:
+        backend = CachedBackend(backend, response_cache.ResponseCache())
+    return backend
+
+
+def get_backend():
+    """Return the process-wide backend configured by LLM_BACKENDS"""
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = create_backend(BACKEND_NAMES)
+        return _backend
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import math
+import time
+import wave
+import struct
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Keep benchmarks reproducible and offline regardless of the local .env
+os.environ.setdefault("RESPONSE_CACHE", "0")
+os.environ.setdefault("SUMMARIZE_HISTORY", "0")
+
+import metrics
+import openai_client
+import ollama_client
+import mock_llm_server
+
+ROOMMATES = ("Alex", "Sam", "Jordan", "Riley", "Casey", "Morgan")
+
+# Lines the scripted roommates take turns saying
+SCRIPT = [
+    "I feel like I'm always the one taking out the trash.",
+    "That's not fair, I did it twice last week.",
+    "The dishes pile up in the sink for days.",
+    "I work late shifts, so I can't always do them right away.",
+    "Can we talk about guests staying over on weeknights?",
+    "My partner only stays over on weekends, and they're quiet.",
+    "The rent split doesn't reflect that my room is smaller.",
+    "We agreed on fifty-fifty when we signed the lease.",
+    "Music after midnight keeps me awake before early classes.",
+    "I'll use headphones, but I need the living room sometimes too.",
+]
+
+CLIENTS = {
+    "openai": openai_client,
+    "ollama": ollama_client,
+}
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def point_clients_at(base_url):
+    """Send both clients' requests to the mock server"""
+    openai_client.API_URL = f"{base_url}/v1/chat/completions"
+    openai_client.API_KEY = openai_client.API_KEY or "benchmark"
+    ollama_client.OLLAMA_API_URL = f"{base_url}/api/chat"
+
+
+def run_conversation(client, turns, stream, roommates=2):
+    """
+    Play one scripted conversation through prepare_therapy_context and
+    the client, as the app does. Returns the number of failed turns.
+    """
+    context = client.new_context()
+    messages = [{"role": "assistant", "content": "Who would like to start?"}]
+    failures = 0
+    for turn in range(turns):
+        speaker = ROOMMATES[turn % roommates]
+        line = SCRIPT[turn % len(SCRIPT)]
+        messages.append({"role": "user", "speaker": speaker, "content": f"**{speaker}**: {line}"})
+
+        started = time.perf_counter()
+        prompt = client.prepare_therapy_context(messages, speaker, context=context)
+        if stream:
+            reply = "".join(client.stream_response(prompt))
+        else:
+            reply = client.get_response(prompt)
+        metrics.record("bench.turn", time.perf_counter() - started)
+
+        if reply.startswith("Error") or reply.startswith("Unexpected error"):
+            failures += 1
+        messages.append({"role": "assistant", "content": reply})
+    return failures
+
+
+def benchmark_llm(backend, lengths, conversations, stream, roommates=2):
+    """Run `conversations` concurrent conversations of each length and report throughput"""
+    client = CLIENTS[backend]
+    results = []
+    for turns in lengths:
+        metrics.reset()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=conversations) as pool:
+            failures = sum(pool.map(lambda _: run_conversation(client, turns, stream, roommates), range(conversations)))
+        elapsed = time.perf_counter() - started
+        total = turns * conversations
+        results.append({
+            "benchmark": f"{backend}{'-stream' if stream else ''}",
+            "turns_per_conversation": turns,
+            "conversations": conversations,
+            "turns": total,
+            "failed_turns": failures,
+            "seconds": elapsed,
+            "turns_per_sec": total / elapsed if elapsed else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": metrics.snapshot()["stages"],
+        })
+    return results
+
+
+def write_synthetic_wav(path, seconds, sample_rate=16000):
+    """
+    Write a 16-bit mono WAV with two alternating "voices" (tones at
+    different pitches) separated by short silences.
+    """
+    turn_seconds = 2.0
+    gap_seconds = 0.4
+    frames = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        t = i / sample_rate
+        position = t % (turn_seconds + gap_seconds)
+        if position >= turn_seconds:
+            sample = 0
+        else:
+            frequency = 140 if int(t // (turn_seconds + gap_seconds)) % 2 == 0 else 220
+            sample = int(8000 * math.sin(2 * math.pi * frequency * t))
+        frames += struct.pack("<h", sample)
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(bytes(frames))
+
+
+def benchmark_voice(recordings, seconds, workers):
+    """Diarize and transcribe synthetic recordings concurrently with the fake speech engine"""
+    import stt_engines
+    import voice_recognition
+    stt_engines.set_engine(stt_engines.FakeEngine())
+
+    paths = []
+    for i in range(recordings):
+        fd, path = tempfile.mkstemp(prefix="bench_", suffix=".wav")
+        os.close(fd)
+        write_synthetic_wav(path, seconds)
+        paths.append(path)
+
+    try:
+        metrics.reset()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            segments = list(pool.map(voice_recognition.process_audio_for_therapy, paths))
+        elapsed = time.perf_counter() - started
+    finally:
+        for path in paths:
+            os.remove(path)
+
+    return [{
+        "benchmark": "voice",
+        "recordings": recordings,
+        "recording_seconds": seconds,
+        "segments": sum(len(result) for result in segments),
+        "seconds": elapsed,
+        "recordings_per_min": 60 * recordings / elapsed if elapsed else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": metrics.snapshot()["stages"],
+    }]
+
+
+def print_stages(stages):
+    """Print the p50/p95/p99 table of a metrics snapshot's stages"""
+    print(f"{'stage':<28}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, entry in stages.items():
+        if "p50" not in entry:
+            continue
+        print(f"{stage:<28}{entry['count']:>8}"
+              f"{entry['p50'] * 1000:>10.1f}{entry['p95'] * 1000:>10.1f}{entry['p99'] * 1000:>10.1f}")
+
+
+def print_report(results):
+    for result in results:
+        if result["benchmark"] == "voice":
+            print(f"\n== voice: {result['recordings']} x {result['recording_seconds']}s recordings ==")
+            print(f"{result['recordings_per_min']:.1f} recordings/min, {result['segments']} segments, "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB")
+        else:
+            print(f"\n== {result['benchmark']}: {result['conversations']} x {result['turns_per_conversation']} turns ==")
+            print(f"{result['turns_per_sec']:.1f} turns/s, {result['failed_turns']} failed, "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB")
+        print_stages(result["stages"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput and latency benchmarks against a mock LLM server")
+    parser.add_argument("--backend", choices=["openai", "ollama", "both"], default="both")
+    parser.add_argument("--lengths", default="10,50,200", help="comma-separated conversation lengths in turns")
+    parser.add_argument("--conversations", type=int, default=4, help="conversations run concurrently")
+    parser.add_argument("--roommates", type=int, default=2, choices=range(2, len(ROOMMATES) + 1), help="speakers per conversation")
+    parser.add_argument("--stream", action="store_true", help="stream responses instead of waiting for them")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock server delay before the first byte")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--response-tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--voice", type=int, default=0, help="number of synthetic recordings to process (0 skips)")
+    parser.add_argument("--voice-seconds", type=float, default=10.0)
+    parser.add_argument("--voice-workers", type=int, default=2)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    settings = mock_llm_server.MockSettings(
+        latency=args.latency,
+        tokens_per_sec=args.tokens_per_sec,
+        response_tokens=args.response_tokens,
+        error_rate=args.error_rate,
+        seed=0
+    )
+    server = mock_llm_server.start_server(settings)
+    point_clients_at(f"http://127.0.0.1:{server.server_address[1]}")
+
+    lengths = [int(length) for length in args.lengths.split(",") if length.strip()]
+    backends = ["openai", "ollama"] if args.backend == "both" else [args.backend]
+
+    results = []
+    for backend in backends:
+        results.extend(benchmark_llm(backend, lengths, args.conversations, args.stream, args.roommates))
+    if args.voice:
+        results.extend(benchmark_voice(args.voice, args.voice_seconds, args.voice_workers))
+    server.shutdown()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
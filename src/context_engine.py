@@ -0,0 +1,131 @@
+import os
+import json
+from functools import lru_cache
+# tiktoken gives exact counts for OpenAI models; fall back to an estimate without it
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Context window per model, minus room for the reply (max_tokens / num_predict)
+TOKEN_BUDGETS = {
+    "gpt-3.5-turbo": 16385 - 1024,
+    "gpt-4-turbo": 128000 - 1024,
+    "llama3": 8192 - 1024,
+}
+DEFAULT_TOKEN_BUDGET = 4096
+
+# Rough characters-per-token ratio used when tiktoken isn't installed
+CHARS_PER_TOKEN = 4
+
+
+def get_token_budget(model):
+    """Return the prompt token budget for a model, overridable via CONTEXT_TOKEN_BUDGET"""
+    override = os.getenv("CONTEXT_TOKEN_BUDGET")
+    if override:
+        return int(override)
+    return TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET)
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Non-OpenAI models (e.g. llama3) get a close-enough approximation
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=256)
+def count_tokens(text, model=None):
+    """Count the tokens in a piece of text for the given model"""
+    if tiktoken is not None:
+        return len(_get_encoding(model or "gpt-3.5-turbo").encode(text))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class ConversationContext:
+    """
+    Incrementally maintained, token-budgeted view of a conversation.
+
+    Each source message is formatted and token-counted exactly once when it
+    is first seen. The oldest entries slide out of the window once the
+    history no longer fits in the budget, or once an optional summarizer
+    has rolled them up; the pinned system prompt is accounted for
+    separately and never trimmed.
+    """
+
+    def __init__(self, format_message, model, reserved_tokens=0, summarizer=None):
+        self.format_message = format_message
+        self.summarizer = summarizer
+        self.model = model
+        self.budget = get_token_budget(model) - reserved_tokens
+        self.entries = []  # (formatted message, token count)
+        self.fragments = []  # JSON encoding of each entry, made once alongside its token count
+        self.synced = 0    # number of source messages consumed so far
+        self.start = 0     # index of the first entry inside the window
+        self.window_tokens = 0
+
+    def reset(self):
+        self.entries = []
+        self.fragments = []
+        self.synced = 0
+        self.start = 0
+        self.window_tokens = 0
+        if self.summarizer is not None:
+            self.summarizer.reset()
+
+    def sync(self, messages):
+        """Append any messages not yet seen and trim the window to the budget"""
+        if len(messages) < self.synced:
+            # The transcript was cleared or replaced, start over
+            self.reset()
+
+        for msg in messages[self.synced:]:
+            formatted = self.format_message(msg)
+            if formatted is None:
+                continue
+            text = formatted["content"] if isinstance(formatted, dict) else formatted
+            tokens = count_tokens(text, self.model)
+            self.entries.append((formatted, tokens))
+            self.fragments.append(json.dumps(formatted))
+            self.window_tokens += tokens
+        self.synced = len(messages)
+
+        if self.summarizer is not None:
+            # The summary takes the place of the turns it covers in the prompt
+            self.summarizer.update(self)
+            self.trim(self.budget - self.summarizer.tokens)
+        else:
+            self.trim(self.budget)
+
+    def trim(self, budget):
+        """Slide the oldest entries out of the window until it fits the budget"""
+        # Always keep the newest entry, even if it alone is over budget
+        while self.window_tokens > budget and self.start < len(self.entries) - 1:
+            self.window_tokens -= self.entries[self.start][1]
+            self.start += 1
+
+    def advance(self, index):
+        """Move the start of the window forward to the given entry index"""
+        while self.start < min(index, len(self.entries)):
+            self.window_tokens -= self.entries[self.start][1]
+            self.start += 1
+
+    def summary(self):
+        """Return the rolled-up summary of older turns, or an empty string"""
+        if self.summarizer is None:
+            return ""
+        return self.summarizer.render()
+
+    def window(self):
+        """Return the formatted messages currently inside the budget"""
+        return [formatted for formatted, _ in self.entries[self.start:]]
+
+    def window_fragments(self):
+        """Return the JSON encodings of the messages in window(), in the same order"""
+        return self.fragments[self.start:]
+
+    def dropped(self):
+        """Return the formatted messages that have been trimmed from the window"""
+        return [formatted for formatted, _ in self.entries[:self.start]]
@@ -0,0 +1,128 @@
+import os
+import time
+import queue
+import threading
+import metrics
+from concurrent.futures import Future
+
+# Most recordings taken off the queue in one batch
+MAX_BATCH = int(os.environ.get("DIARIZATION_MAX_BATCH", "8"))
+# Torch intra-op threads; leaves cores for transcription and the web server
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Sliding-window chunks the segmentation and embedding models score per forward pass
+INFERENCE_BATCH_SIZE = int(os.environ.get("DIARIZATION_INFERENCE_BATCH", "32"))
+
+
+class DiarizationScheduler:
+    """
+    Runs speaker diarization for every session on one dedicated thread.
+
+    Work starts as soon as a recording arrives; recordings that queue up
+    meanwhile are taken together as the next batch and diarized back to
+    back on the already loaded model, with torch capped at TORCH_THREADS
+    so concurrent jobs don't fight over cores. Callers get a Future with
+    the pyannote Annotation, or the error if the model can't be loaded.
+    """
+
+    def __init__(self, load_pipeline, max_batch=MAX_BATCH, threads=TORCH_THREADS):
+        self.load_pipeline = load_pipeline
+        self.max_batch = max_batch
+        self.threads = threads
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.metrics = {
+            "batches": 0,
+            "recordings": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "wait_seconds": 0.0,
+            "inference_seconds": 0.0,
+        }
+
+    def submit(self, waveform):
+        """Queue an in-memory waveform ({"waveform", "sample_rate"}) and return a Future"""
+        future = Future()
+        # Diarization runs on another thread, so carry the caller's session along
+        self.jobs.put((waveform, future, time.monotonic(), metrics.current_session()))
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="diarization", daemon=True)
+                self.thread.start()
+        return future
+
+    def diarize(self, waveform, timeout=None):
+        """Diarize a waveform and wait for the result"""
+        return self.submit(waveform).result(timeout=timeout)
+
+    def stats(self):
+        """Return queue depth and batch metrics"""
+        with self.lock:
+            stats = dict(self.metrics)
+        stats["queue_depth"] = self.jobs.qsize()
+        stats["mean_batch_size"] = stats["recordings"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def _configure(self, pipeline):
+        # Score more sliding-window chunks per forward pass; ignored by pipelines without these knobs
+        for attribute in ("segmentation_batch_size", "embedding_batch_size"):
+            if hasattr(pipeline, attribute):
+                setattr(pipeline, attribute, INFERENCE_BATCH_SIZE)
+        import torch
+        torch.set_num_threads(self.threads)
+
+    def _collect(self):
+        """Block for the first job, then take whatever else is already waiting"""
+        batch = [self.jobs.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _load(self):
+        """Load and configure the pipeline; returns (pipeline, error) and never raises"""
+        try:
+            pipeline = self.load_pipeline()
+        except Exception as e:
+            print(f"Error loading speaker diarization pipeline: {e}")
+            return None, e
+        if pipeline is None:
+            return None, None
+        try:
+            self._configure(pipeline)
+        except Exception as e:
+            # The model still works with torch's default threading
+            print(f"Warning: could not configure speaker diarization: {e}")
+        return pipeline, None
+
+    def _run(self):
+        # Whatever goes wrong while loading, queued callers get an error rather than waiting forever
+        pipeline, error = self._load()
+
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            for waveform, future, submitted, session_id in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                metrics.set_session(session_id)
+                metrics.record("voice.diarization_wait", time.monotonic() - submitted)
+                try:
+                    if pipeline is None:
+                        reason = f": {error}" if error is not None else ""
+                        raise RuntimeError(f"Speaker diarization pipeline is not available{reason}")
+                    with metrics.span("voice.diarization"):
+                        future.set_result(pipeline(waveform))
+                except Exception as e:
+                    future.set_exception(e)
+            metrics.set_session(None)
+
+            with self.lock:
+                self.metrics["batches"] += 1
+                self.metrics["recordings"] += len(batch)
+                self.metrics["last_batch_size"] = len(batch)
+                self.metrics["max_batch_size"] = max(self.metrics["max_batch_size"], len(batch))
+                self.metrics["wait_seconds"] += sum(started - submitted for _, _, submitted, _ in batch)
+                self.metrics["inference_seconds"] += time.monotonic() - started
@@ -0,0 +1,172 @@
+import os
+import time
+import threading
+import metrics
+from room_scheduler import FairScheduler
+
+# Responses generated at once on this host; further turns wait in the queue
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "8"))
+# Seconds a finished job is kept so a rerun or reconnect can still pick it up
+JOB_TTL = float(os.getenv("GENERATION_JOB_TTL", "600"))
+
+
+class GenerationJob:
+    """
+    One assistant turn being generated in the background. Tokens are
+    buffered as they arrive, so any number of script runs can follow the
+    job from the start, even after the run that submitted it is gone.
+    """
+
+    def __init__(self, session_id, turn_id):
+        self.session_id = session_id
+        self.turn_id = turn_id
+        self.tokens = []
+        self.done = False
+        self.saved = False
+        self.submitted_at = time.monotonic()
+        self.finished_at = None
+        self.cond = threading.Condition()
+
+    def append(self, token):
+        with self.cond:
+            self.tokens.append(token)
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self.cond.notify_all()
+
+    def mark_saved(self):
+        with self.cond:
+            self.saved = True
+            self.cond.notify_all()
+
+    def wait_saved(self, timeout=None):
+        """Wait until the job's on_complete callback (e.g. persisting the reply) has run"""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.saved, timeout)
+
+    def text(self):
+        with self.cond:
+            return "".join(self.tokens)
+
+    def follow(self, timeout=None):
+        """Yield the response so far each time it grows, until the job is done"""
+        seen = 0
+        while True:
+            with self.cond:
+                while len(self.tokens) == seen and not self.done:
+                    if not self.cond.wait(timeout):
+                        return
+                seen = len(self.tokens)
+                text = "".join(self.tokens)
+                done = self.done
+            yield text
+            if done:
+                return
+
+
+class GenerationQueue:
+    """
+    Runs LLM generation on a fixed set of workers, independent of Streamlit
+    script runs. Jobs are keyed by (session_id, turn_id); submitting the
+    same turn twice returns the job already running. Workers take jobs
+    from a FairScheduler, so rooms share the capacity fairly.
+    """
+
+    def __init__(self, workers=GENERATION_WORKERS, scheduler=None):
+        self.scheduler = scheduler or FairScheduler()
+        self.jobs = {}  # (session_id, turn_id) -> GenerationJob
+        self.lock = threading.Lock()
+        self.workers = [
+            threading.Thread(target=self._work, name=f"generate-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, session_id, turn_id, backend, prompt, on_complete=None, room_id=None):
+        """
+        Start generating a turn unless it is already queued or running.
+        Jobs are scheduled per room (the session itself if no room is given).
+        `on_complete(job)` runs on the worker once the response is finished,
+        e.g. to persist it whether or not anyone is still watching.
+        """
+        with self.lock:
+            self._prune()
+            job = self.jobs.get((session_id, turn_id))
+            if job is not None:
+                return job
+            job = self.jobs[(session_id, turn_id)] = GenerationJob(session_id, turn_id)
+        self.scheduler.put(room_id or session_id, (job, backend, prompt, on_complete))
+        return job
+
+    def get(self, session_id, turn_id):
+        with self.lock:
+            return self.jobs.get((session_id, turn_id))
+
+    def latest(self, session_id):
+        """Return the most recently submitted job of a session, or None"""
+        with self.lock:
+            jobs = [job for (owner, _), job in self.jobs.items() if owner == session_id]
+        return max(jobs, key=lambda job: job.submitted_at) if jobs else None
+
+    def _prune(self):
+        now = time.monotonic()
+        expired = [key for key, job in self.jobs.items() if job.done and now - job.finished_at > JOB_TTL]
+        for key in expired:
+            del self.jobs[key]
+
+    def _work(self):
+        while True:
+            scheduled = self.scheduler.get()
+            if scheduled is None:
+                return
+            room_id, (job, backend, prompt, on_complete) = scheduled
+            try:
+                self._run(job, backend, prompt, on_complete)
+            finally:
+                self.scheduler.done(room_id)
+
+    def shutdown(self):
+        """Stop the workers once their current jobs finish; queued jobs are dropped"""
+        self.scheduler.close()
+        for worker in self.workers:
+            worker.join()
+
+    def _run(self, job, backend, prompt, on_complete):
+        metrics.set_session(job.session_id)
+        metrics.record("generation.queue_wait", time.monotonic() - job.submitted_at)
+        try:
+            for token in backend.stream_response(prompt):
+                if not job.tokens:
+                    metrics.record("turn.first_token", time.monotonic() - job.submitted_at)
+                job.append(token)
+        except Exception as e:
+            job.append(f"Error communicating with the language model: {str(e)}")
+        finally:
+            job.finish()
+            metrics.record("turn.total", time.monotonic() - job.submitted_at)
+        try:
+            if on_complete is not None:
+                on_complete(job)
+        except Exception as e:
+            print(f"Error saving generated response for session {job.session_id}: {e}")
+        finally:
+            job.mark_saved()
+            metrics.set_session(None)
+
+
+_queue = None
+_lock = threading.Lock()
+
+
+def get_queue():
+    """Return the process-wide generation queue"""
+    global _queue
+    with _lock:
+        if _queue is None:
+            _queue = GenerationQueue()
+        return _queue
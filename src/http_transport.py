@@ -0,0 +1,145 @@
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Timeouts in seconds; the read timeout applies between bytes, so long
+# streamed generations are fine as long as tokens keep arriving
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+
+# Retry settings for transient failures
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Connection pool size per backend
+POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+
+# Circuit breaker settings
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised when a backend's circuit breaker is open and requests fail fast"""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        """Return True if a request may be attempted"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # After the reset timeout let a single trial request through (half-open)
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_sessions = {}
+_breakers = {}
+_lock = threading.Lock()
+
+
+def get_session(backend):
+    """Return the pooled keep-alive session for a backend, creating it on first use"""
+    with _lock:
+        if backend not in _sessions:
+            session = requests.Session()
+            # Retries are handled in post() so that Retry-After and the breaker are honored
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[backend] = session
+        return _sessions[backend]
+
+
+def get_breaker(backend):
+    """Return the circuit breaker for a backend"""
+    with _lock:
+        if backend not in _breakers:
+            _breakers[backend] = CircuitBreaker()
+        return _breakers[backend]
+
+
+def retry_delay(attempt, response=None):
+    """
+    Work out how long to wait before the next attempt, preferring the
+    server's Retry-After header over jittered exponential backoff.
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                try:
+                    wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                    return min(max(wait, 0), BACKOFF_MAX)
+                except (TypeError, ValueError):
+                    pass
+    # Full jitter keeps many workers from retrying in lockstep
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def post(backend, url, **kwargs):
+    """
+    POST through the backend's pooled session with timeouts, retry/backoff
+    on connection errors and retryable status codes, and a circuit breaker.
+    Returns the final response; raises requests exceptions like requests.post.
+    """
+    breaker = get_breaker(backend)
+    if not breaker.allow_request():
+        raise CircuitOpenError(f"{backend} backend is unavailable, circuit breaker is open")
+
+    session = get_session(backend)
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = session.post(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == MAX_RETRIES:
+                breaker.record_failure()
+                raise
+            time.sleep(retry_delay(attempt))
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES:
+            if attempt < MAX_RETRIES:
+                delay = retry_delay(attempt, response)
+                response.close()
+                time.sleep(delay)
+                continue
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
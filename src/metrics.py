@@ -0,0 +1,204 @@
+import os
+import json
+import math
+import time
+import threading
+import functools
+from collections import deque, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Set METRICS_ENABLED=0 to turn all spans and counters into no-ops
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+# Most recent samples per stage used for percentiles
+METRICS_WINDOW = int(os.environ.get("METRICS_WINDOW", "1024"))
+# Port for the /metrics (Prometheus) and /metrics.json endpoints; 0 disables the server
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# Spans kept per session for the debug panel
+SESSION_SPANS = 200
+# Sessions whose spans are kept; the least recently active are forgotten first
+METRICS_SESSIONS = int(os.environ.get("METRICS_SESSIONS", "256"))
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_stages = {}  # stage -> {"samples": deque, "count": int, "sum": float}
+_counters = {}  # name -> total
+_sessions = OrderedDict()  # session_id -> deque of (stage, seconds, recorded_at), least recent first
+_lock = threading.Lock()
+_local = threading.local()
+_server = None
+
+
+def set_session(session_id):
+    """Attribute spans recorded on this thread to a chat session (None to stop)"""
+    _local.session_id = session_id
+
+
+def current_session():
+    """Return the session spans on this thread are attributed to"""
+    return getattr(_local, "session_id", None)
+
+
+def record(stage, seconds, session_id=None):
+    """Record one duration for a stage"""
+    if not METRICS_ENABLED:
+        return
+    session_id = session_id or current_session()
+    with _lock:
+        stats = _stages.get(stage)
+        if stats is None:
+            stats = _stages[stage] = {"samples": deque(maxlen=METRICS_WINDOW), "count": 0, "sum": 0.0}
+        stats["samples"].append(seconds)
+        stats["count"] += 1
+        stats["sum"] += seconds
+        if session_id is not None:
+            spans = _sessions.get(session_id)
+            if spans is None:
+                spans = _sessions[session_id] = deque(maxlen=SESSION_SPANS)
+                while len(_sessions) > METRICS_SESSIONS:
+                    _sessions.popitem(last=False)
+            else:
+                _sessions.move_to_end(session_id)
+            spans.append((stage, seconds, time.time()))
+
+
+def count(name, value=1):
+    """Add to a counter, e.g. tokens generated"""
+    if not METRICS_ENABLED or value is None:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+class span:
+    """Context manager timing a stage: `with metrics.span("openai.request"): ...`"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+def timed(stage):
+    """Decorator recording each call of a function as a span"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _quantile(ordered, q):
+    """Nearest-rank quantile of a sorted list"""
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+def percentiles(stage):
+    """Return p50/p95/p99 of the recent samples of a stage, or None if it has none"""
+    with _lock:
+        stats = _stages.get(stage)
+        ordered = sorted(stats["samples"]) if stats else []
+    if not ordered:
+        return None
+    return {f"p{int(q * 100)}": _quantile(ordered, q) for q in QUANTILES}
+
+
+def snapshot():
+    """Return all stages and counters as a JSON-serialisable dict"""
+    with _lock:
+        stages = {stage: (sorted(stats["samples"]), stats["count"], stats["sum"]) for stage, stats in _stages.items()}
+        counters = dict(_counters)
+    result = {"stages": {}, "counters": counters}
+    for stage, (ordered, total, seconds) in sorted(stages.items()):
+        entry = {"count": total, "sum": seconds}
+        if ordered:
+            entry.update({f"p{int(q * 100)}": _quantile(ordered, q) for q in QUANTILES})
+        result["stages"][stage] = entry
+    return result
+
+
+def session_spans(session_id):
+    """Return the most recent spans of one session as (stage, seconds, recorded_at), oldest first"""
+    with _lock:
+        return list(_sessions.get(session_id, ()))
+
+
+def forget_session(session_id):
+    """Drop a session's spans once the session has ended"""
+    with _lock:
+        _sessions.pop(session_id, None)
+
+
+def render_prometheus():
+    """Render the metrics in the Prometheus text exposition format"""
+    data = snapshot()
+    lines = [
+        "# HELP roommates_stage_seconds Duration of each turn pipeline stage",
+        "# TYPE roommates_stage_seconds summary",
+    ]
+    for stage, entry in data["stages"].items():
+        for q in QUANTILES:
+            key = f"p{int(q * 100)}"
+            if key in entry:
+                lines.append(f'roommates_stage_seconds{{stage="{stage}",quantile="{q}"}} {entry[key]:.6f}')
+        lines.append(f'roommates_stage_seconds_sum{{stage="{stage}"}} {entry["sum"]:.6f}')
+        lines.append(f'roommates_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+    lines.append("# HELP roommates_events_total Counters such as tokens processed")
+    lines.append("# TYPE roommates_events_total counter")
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f'roommates_events_total{{name="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Forget all samples, counters and session spans"""
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _sessions.clear()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = render_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(snapshot()), "application/json"
+        else:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=METRICS_PORT):
+    """
+    Start the metrics endpoint on a background thread, once per process.
+    Returns the server, or None when no port is configured.
+    """
+    global _server
+    with _lock:
+        if _server is None and port:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            except OSError as e:
+                # Another Streamlit process on this host already serves it
+                print(f"Warning: Could not start metrics endpoint on port {port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server
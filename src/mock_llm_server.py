@@ -0,0 +1,226 @@
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Words the mock responses are made of; one word is one token
+RESPONSE_WORDS = (
+    "It sounds like you both care about keeping the apartment a comfortable place "
+    "to live. Could you each describe what a fair split of the chores would look like?"
+).split()
+
+
+class MockSettings:
+    """
+    Behaviour of the mock server. `latency` is the delay before the first
+    byte, `tokens_per_sec` the generation speed (0 for instant) and
+    `error_rate` the fraction of requests answered with `error_status`.
+    """
+
+    def __init__(self, latency=0.05, tokens_per_sec=50.0, response_tokens=40, error_rate=0.0, error_status=500, seed=None):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    def tokens(self):
+        return [RESPONSE_WORDS[i % len(RESPONSE_WORDS)] + " " for i in range(self.response_tokens)]
+
+    def pause(self):
+        """Sleep for the time one token takes to generate"""
+        if self.tokens_per_sec:
+            time.sleep(1 / self.tokens_per_sec)
+
+
+def _prompt_tokens(request):
+    """Rough prompt size: whitespace-separated words across all messages"""
+    if "messages" in request:
+        return sum(len(str(message.get("content", "")).split()) for message in request["messages"])
+    return len(str(request.get("prompt", "")).split())
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Small header and body writes would otherwise wait on delayed ACKs
+    disable_nagle_algorithm = True
+    settings = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+
+        routes = {
+            "/v1/chat/completions": self._openai,
+            "/api/chat": self._ollama,
+            "/api/generate": self._ollama,
+        }
+        handler = routes.get(self.path)
+        if handler is None:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        time.sleep(self.settings.latency)
+        if self.settings.should_fail():
+            self._send_json(self.settings.error_status, {"error": "mock failure"})
+            return
+        handler(request)
+
+    def _send_json(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _openai(self, request):
+        tokens = self.settings.tokens()
+        usage = {
+            "prompt_tokens": _prompt_tokens(request),
+            "completion_tokens": len(tokens),
+            "total_tokens": _prompt_tokens(request) + len(tokens),
+        }
+        if not request.get("stream"):
+            for _ in tokens:
+                self.settings.pause()
+            self._send_json(200, {
+                "object": "chat.completion",
+                "model": request.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        # Server-sent events, one token per event
+        self._start_stream("text/event-stream")
+        for token in tokens:
+            self.settings.pause()
+            chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": token}}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        if request.get("stream_options", {}).get("include_usage"):
+            self._write_chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_stream()
+
+    def _ollama(self, request):
+        tokens = self.settings.tokens()
+        chat = "messages" in request
+        started = time.perf_counter()
+
+        def message(text):
+            return {"message": {"role": "assistant", "content": text}} if chat else {"response": text}
+
+        def final():
+            elapsed = int((time.perf_counter() - started) * 1e9)
+            return {
+                "model": request.get("model"),
+                "done": True,
+                "prompt_eval_count": _prompt_tokens(request),
+                "prompt_eval_duration": 0,
+                "eval_count": len(tokens),
+                "eval_duration": elapsed,
+                "load_duration": 0,
+                "total_duration": elapsed,
+            }
+
+        # Ollama streams unless told otherwise
+        if request.get("stream") is False:
+            for _ in tokens:
+                self.settings.pause()
+            data = final()
+            data.update(message("".join(tokens)))
+            self._send_json(200, data)
+            return
+
+        # Newline-delimited JSON, one token per line
+        self._start_stream("application/x-ndjson")
+        for token in tokens:
+            self.settings.pause()
+            chunk = {"model": request.get("model"), "done": False}
+            chunk.update(message(token))
+            self._write_chunk((json.dumps(chunk) + "\n").encode())
+        data = final()
+        data.update(message(""))
+        self._write_chunk((json.dumps(data) + "\n").encode())
+        self._end_stream()
+
+
+class _MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients abandoning a stream (e.g. after a failover) are expected
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+
+def start_server(settings=None, host="127.0.0.1", port=0):
+    """
+    Start the mock server on a background thread and return it. With
+    port=0 a free port is picked; read it from server.server_address.
+    """
+    handler = type("MockHandler", (_MockHandler,), {"settings": settings or MockSettings()})
+    server = _MockServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI and Ollama APIs")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before the first byte")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--response-tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency, args.tokens_per_sec, args.response_tokens, args.error_rate)
+    server = start_server(settings, port=args.port)
+    print(f"Mock LLM server listening on http://127.0.0.1:{server.server_address[1]}")
+    print("  OpenAI: /v1/chat/completions  Ollama: /api/chat, /api/generate")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,51 @@
+import os
+import time
+import threading
 import requests
 import json
+import http_transport
+import prompt_templates
+import metrics
 
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
+# The chat endpoint lets Ollama reuse the KV cache for an unchanged message prefix
+OLLAMA_API_URL = "http://localhost:11434/api/chat"
 MODEL_NAME = "llama3"
 
-def prepare_therapy_context(messages, current_speaker):
+# How long Ollama keeps the model (and its prompt cache) loaded between turns
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Request bodies are pre-serialized, so the content type is set explicitly
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Timing metadata from the most recent completed request
+last_timings = {}
+_timings_lock = threading.Lock()
+
+def new_context(summarize=True, rolling_summary=None):
     """
-    Prepare the context for the therapy session, including conversation history
-    and information about the current speaker.
+    Create an incremental context for one session. Keep it alongside the
+    session's messages and pass it to prepare_therapy_context every turn.
     """
-    # Start with system prompt that instructs the model how to behave
-    system_prompt = """You are a skilled and empathetic roommate mediator with years of experience helping people navigate shared living situations.
-Your role is to facilitate a constructive conversation between roommates who are seeking help with their living arrangement issues.
-- Always maintain a neutral, non-judgmental stance
-- Recognize and acknowledge the feelings of both roommates
-- Help identify common roommate problems like chore distribution, noise levels, personal space, shared expenses, and guest policies
-- Suggest practical solutions for common roommate conflicts
-- Ask clarifying questions when needed
-- Provide insights based on what you've heard from both roommates
-- Remember details about each roommate and reference them appropriately
-- Recognize who is currently speaking to you
-
-You should address the current speaker directly while keeping in mind the context of the entire conversation.
-"""
-
-    # Convert the message history into a format suitable for the model
-    conversation_history = []
-    for msg in messages:
-        if msg["role"] == "user":
-            conversation_history.append(msg["content"])
-        elif msg["role"] == "assistant":
-            conversation_history.append(f"Therapist: {msg['content']}")
-    
-    # Add information about who is currently speaking
-    context = f"{system_prompt}\n\nConversation history:\n"
-    context += "\n".join(conversation_history)
-    context += f"\n\nCurrent speaker: {current_speaker}\n\nYour response as the therapist:"
-    
-    return context
+    return prompt_templates.new_context(MODEL_NAME, complete, summarize, rolling_summary)
 
-def get_response(prompt):
+@metrics.timed("ollama.prepare_context")
+def prepare_therapy_context(messages, current_speaker, context=None):
     """
-    Send a request to the Ollama API and get a response.
+    Prepare the context for the therapy session, including conversation history
+    and information about the current speaker.
+    
+    The system prompt always comes first and the per-turn speaker note last,
+    so consecutive turns share a message prefix Ollama can serve from its cache.
     """
-    data = {
+    return prompt_templates.prepare_therapy_context(messages, current_speaker, context, MODEL_NAME)
+
+def _build_request(messages, stream=False):
+    """Return the payload for a chat request"""
+    return {
         "model": MODEL_NAME,
-        "prompt": prompt,
-        "stream": False,
+        "messages": messages,
+        "stream": stream,
+        "keep_alive": KEEP_ALIVE,
         "options": {
             "temperature": 0.7,
             "top_p": 0.9,
@@ -54,12 +53,128 @@ def get_response(prompt):
             "num_predict": 1024
         }
     }
-    
+
+def record_timings(data):
+    """
+    Keep the prompt-eval vs eval timings Ollama reports on its final message.
+    Durations are converted from nanoseconds to seconds.
+    """
+    timings = {
+        "load_duration": data.get("load_duration", 0) / 1e9,
+        "prompt_eval_count": data.get("prompt_eval_count", 0),
+        "prompt_eval_duration": data.get("prompt_eval_duration", 0) / 1e9,
+        "eval_count": data.get("eval_count", 0),
+        "eval_duration": data.get("eval_duration", 0) / 1e9,
+        "total_duration": data.get("total_duration", 0) / 1e9,
+    }
+    with _timings_lock:
+        last_timings.clear()
+        last_timings.update(timings)
+    metrics.count("ollama.prompt_tokens", timings["prompt_eval_count"])
+    metrics.count("ollama.completion_tokens", timings["eval_count"])
+    for stage in ("load", "prompt_eval", "eval"):
+        if timings[f"{stage}_duration"]:
+            metrics.record(f"ollama.{stage}", timings[f"{stage}_duration"])
+    return timings
+
+def get_timings():
+    """Return a copy of the timings from the most recent completed request"""
+    with _timings_lock:
+        return dict(last_timings)
+
+def request_fingerprint(messages):
+    """Return the request payload, used for response cache keys"""
+    return _build_request(messages)
+
+@metrics.timed("ollama.request")
+def fetch_response(messages):
+    """
+    Send a request to the Ollama API and return the response text.
+    Unlike get_response, errors are raised rather than returned as text.
+    """
+    body = prompt_templates.render_body(_build_request(messages))
+    response = http_transport.post("ollama", OLLAMA_API_URL, headers=JSON_HEADERS, data=body)
+    response.raise_for_status()
+    data = response.json()
+    record_timings(data)
+    return data["message"]["content"]
+
+def get_response(messages):
+    """
+    Send a request to the Ollama API and get a response.
+    """
     try:
-        response = requests.post(OLLAMA_API_URL, json=data)
-        response.raise_for_status()
-        return response.json()["response"]
+        return fetch_response(messages)
     except requests.exceptions.RequestException as e:
         return f"Error communicating with Ollama: {str(e)}"
     except (KeyError, json.JSONDecodeError):
         return "Error: Received invalid response from Ollama"
+
+
+def complete(prompt, max_tokens=256):
+    """
+    Send a single standalone prompt, e.g. for background summarization.
+    Unlike get_response, errors are raised rather than returned as text.
+    """
+    data = _build_request([{"role": "user", "content": prompt}])
+    data["options"] = {
+        "temperature": 0.3,
+        "num_predict": max_tokens
+    }
+    
+    response = http_transport.post("ollama", OLLAMA_API_URL, json=data)
+    response.raise_for_status()
+    return response.json()["message"]["content"]
+
+
+class OllamaError(Exception):
+    """Raised when Ollama reports an error in the middle of a streamed response"""
+
+
+def iter_response(messages):
+    """
+    Stream a response from the Ollama API, yielding tokens as each
+    newline-delimited JSON chunk arrives. Errors are raised rather than yielded.
+    """
+    data = _build_request(messages, stream=True)
+    started = time.perf_counter()
+    first_token = True
+    
+    body = prompt_templates.render_body(data)
+    
+    with http_transport.post("ollama", OLLAMA_API_URL, headers=JSON_HEADERS, data=body, stream=True) as response:
+        response.raise_for_status()
+        
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise OllamaError(chunk["error"])
+            token = chunk.get("message", {}).get("content")
+            if token:
+                if first_token:
+                    metrics.record("ollama.first_token", time.perf_counter() - started)
+                    first_token = False
+                yield token
+            if chunk.get("done"):
+                # The final chunk carries the timing metadata
+                record_timings(chunk)
+                break
+    
+    metrics.record("ollama.stream", time.perf_counter() - started)
+
+
+def stream_response(messages):
+    """
+    Stream a response from the Ollama API, yielding tokens as each
+    newline-delimited JSON chunk arrives.
+    """
+    try:
+        yield from iter_response(messages)
+    except OllamaError as e:
+        yield f"Error from Ollama: {str(e)}"
+    except requests.exceptions.RequestException as e:
+        yield f"Error communicating with Ollama: {str(e)}"
+    except (KeyError, json.JSONDecodeError):
+        yield "Error: Received invalid response from Ollama"
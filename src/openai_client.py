@@ -1,6 +1,10 @@
 import os
 import json
+import time
 import requests
+import http_transport
+import prompt_templates
+import metrics
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -15,76 +19,147 @@ API_URL = "https://api.openai.com/v1/chat/completions"
 # Using a more cost-effective model
 MODEL_NAME = "gpt-3.5-turbo"
 
-def prepare_therapy_context(messages, current_speaker):
+def new_context(summarize=True, rolling_summary=None):
+    """
+    Create an incremental context for one session. Keep it alongside the
+    session's messages and pass it to prepare_therapy_context every turn.
+    """
+    return prompt_templates.new_context(MODEL_NAME, complete, summarize, rolling_summary)
+
+@metrics.timed("openai.prepare_context")
+def prepare_therapy_context(messages, current_speaker, context=None):
     """
     Prepare the context for the therapy session, including conversation history
     and information about the current speaker.
     """
-    # Start with system message that instructs the model how to behave
-    system_message = {
-        "role": "system", 
-        "content": """You are a skilled and empathetic roommate mediator with years of experience helping people navigate shared living situations.
-Your role is to facilitate a constructive conversation between roommates who are seeking help with their living arrangement issues.
-- Always maintain a neutral, non-judgmental stance
-- Recognize and acknowledge the feelings of both roommates
-- Help identify common roommate problems like chore distribution, noise levels, personal space, shared expenses, and guest policies
-- Suggest practical solutions for common roommate conflicts
-- Ask clarifying questions when needed
-- Provide insights based on what you've heard from both roommates
-- Remember details about each roommate and reference them appropriately
-- Recognize who is currently speaking to you
-
-You should address the current speaker directly while keeping in mind the context of the entire conversation.
-"""
+    return prompt_templates.prepare_therapy_context(messages, current_speaker, context, MODEL_NAME)
+
+def _build_request(messages, stream=False):
+    """Return the headers and payload for a chat completion request"""
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {API_KEY}"
     }
     
-    # Convert the message history into a format suitable for OpenAI
-    formatted_messages = [system_message]
+    payload = {
+        "model": MODEL_NAME,
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 1024,
+        "top_p": 0.9,
+        "frequency_penalty": 0,
+        "presence_penalty": 0
+    }
+    if stream:
+        payload["stream"] = True
+        # Ask for token counts in a final chunk
+        payload["stream_options"] = {"include_usage": True}
     
-    for msg in messages:
-        if msg["role"] == "user":
-            # Extract the speaker name from the content (format is "**Speaker**: message")
-            content = msg["content"]
-            formatted_messages.append({"role": "user", "content": content})
-        elif msg["role"] == "assistant":
-            formatted_messages.append({"role": "assistant", "content": msg["content"]})
+    return headers, payload
+
+def request_fingerprint(messages):
+    """Return the request payload without credentials, used for response cache keys"""
+    return _build_request(messages)[1]
+
+def record_usage(usage):
+    """Count the prompt and completion tokens reported by the API"""
+    if usage:
+        metrics.count("openai.prompt_tokens", usage.get("prompt_tokens"))
+        metrics.count("openai.completion_tokens", usage.get("completion_tokens"))
+
+@metrics.timed("openai.request")
+def fetch_response(messages):
+    """
+    Send a request to the OpenAI API and return the response text.
+    Unlike get_response, errors are raised rather than returned as text.
+    """
+    headers, payload = _build_request(messages)
     
-    # Add information about who is currently speaking
-    formatted_messages.append({
-        "role": "system",
-        "content": f"The current speaker is {current_speaker}. Address your response to them specifically."
-    })
+    # The history is spliced in from cached JSON rather than encoded again
+    response = http_transport.post("openai", API_URL, headers=headers, data=prompt_templates.render_body(payload))
+    response.raise_for_status()  # Raise an exception for HTTP errors
     
-    return formatted_messages
+    response_data = response.json()
+    record_usage(response_data.get("usage"))
+    return response_data["choices"][0]["message"]["content"]
 
 def get_response(messages):
     """
     Send a request to the OpenAI API and get a response using direct HTTP requests.
     """
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {API_KEY}"
-        }
-        
-        payload = {
-            "model": MODEL_NAME,
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 1024,
-            "top_p": 0.9,
-            "frequency_penalty": 0,
-            "presence_penalty": 0
-        }
-        
-        response = requests.post(API_URL, headers=headers, json=payload)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        
-        response_data = response.json()
-        return response_data["choices"][0]["message"]["content"]
+        return fetch_response(messages)
     except requests.exceptions.RequestException as e:
         return f"Error communicating with OpenAI API: {str(e)}"
     except (KeyError, IndexError, json.JSONDecodeError) as e:
         return f"Error processing OpenAI response: {str(e)}"
     except Exception as e:
         return f"Unexpected error: {str(e)}"
+
+
+def complete(prompt, max_tokens=256):
+    """
+    Send a single standalone prompt, e.g. for background summarization.
+    Unlike get_response, errors are raised rather than returned as text.
+    """
+    headers, payload = _build_request([{"role": "user", "content": prompt}])
+    payload["temperature"] = 0.3
+    payload["max_tokens"] = max_tokens
+    
+    response = http_transport.post("openai", API_URL, headers=headers, json=payload)
+    response.raise_for_status()
+    return response.json()["choices"][0]["message"]["content"]
+
+
+def iter_response(messages):
+    """
+    Stream a response from the OpenAI API, yielding content tokens as they
+    arrive over server-sent events. Errors are raised rather than yielded.
+    """
+    headers, payload = _build_request(messages, stream=True)
+    started = time.perf_counter()
+    first_token = True
+    
+    body = prompt_templates.render_body(payload)
+    
+    with http_transport.post("openai", API_URL, headers=headers, data=body, stream=True) as response:
+        response.raise_for_status()
+        
+        for line in response.iter_lines():
+            # Decode explicitly: without a charset requests would assume ISO-8859-1 for text/event-stream
+            line = line.decode("utf-8")
+            # SSE frames look like "data: {...}"; blank lines separate events
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            
+            chunk = json.loads(data)
+            # The usage chunk comes last and has no choices
+            record_usage(chunk.get("usage"))
+            if not chunk.get("choices"):
+                continue
+            token = chunk["choices"][0]["delta"].get("content")
+            if token:
+                if first_token:
+                    metrics.record("openai.first_token", time.perf_counter() - started)
+                    first_token = False
+                yield token
+    
+    metrics.record("openai.stream", time.perf_counter() - started)
+
+
+def stream_response(messages):
+    """
+    Stream a response from the OpenAI API, yielding content tokens as they
+    arrive over server-sent events.
+    """
+    try:
+        yield from iter_response(messages)
+    except requests.exceptions.RequestException as e:
+        yield f"Error communicating with OpenAI API: {str(e)}"
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        yield f"Error processing OpenAI response: {str(e)}"
+    except Exception as e:
+        yield f"Unexpected error: {str(e)}"
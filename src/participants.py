@@ -0,0 +1,93 @@
+# Roommates per session
+MIN_PARTICIPANTS = 2
+MAX_PARTICIPANTS = 6
+
+# Avatar and button colour for each seat, in order
+SEATS = (
+    ("🔴", "#ff5252"),
+    ("🔵", "#3b82f6"),
+    ("🟢", "#22c55e"),
+    ("🟡", "#eab308"),
+    ("🟣", "#a855f7"),
+    ("🟠", "#f97316"),
+)
+
+
+class ParticipantRegistry:
+    """
+    The roommates of one session, addressed by stable IDs ("p1", "p2", ...)
+    so renaming someone doesn't break who said what. Stored with the
+    session as a plain list of {"id", "name", "avatar", "color"} dicts.
+    """
+
+    def __init__(self, participants=()):
+        self.participants = [dict(participant) for participant in participants]
+        self.by_id = {participant["id"]: participant for participant in self.participants}
+
+    @classmethod
+    def default(cls, count=MIN_PARTICIPANTS):
+        registry = cls()
+        for seat in range(count):
+            registry.add(f"Roommate {seat + 1}")
+        return registry
+
+    @classmethod
+    def from_session_info(cls, info):
+        """Load the registry from stored session details, including two-roommate sessions from before IDs"""
+        if info.get("participants"):
+            return cls(info["participants"])
+        if "roommate1_name" in info:
+            registry = cls()
+            registry.add(info["roommate1_name"])
+            registry.add(info.get("roommate2_name", "Roommate 2"))
+            return registry
+        return cls.default()
+
+    def add(self, name):
+        """Add a roommate in the next free seat and return their ID"""
+        if len(self.participants) >= MAX_PARTICIPANTS:
+            raise ValueError(f"A session can have at most {MAX_PARTICIPANTS} roommates")
+        seat = len(self.participants)
+        participant_id = f"p{seat + 1}"
+        avatar, color = SEATS[seat]
+        participant = {"id": participant_id, "name": name, "avatar": avatar, "color": color}
+        self.participants.append(participant)
+        self.by_id[participant_id] = participant
+        return participant_id
+
+    def set_names(self, names):
+        """Rename roommates seat by seat, adding or removing seats to match"""
+        del self.participants[len(names):]
+        for participant, name in zip(self.participants, names):
+            participant["name"] = name
+        for name in names[len(self.participants):]:
+            self.add(name)
+        self.by_id = {participant["id"]: participant for participant in self.participants}
+
+    def ids(self):
+        return [participant["id"] for participant in self.participants]
+
+    def names(self):
+        return [participant["name"] for participant in self.participants]
+
+    def get(self, participant_id):
+        return self.by_id.get(participant_id)
+
+    def name(self, participant_id):
+        return self.by_id[participant_id]["name"]
+
+    def next_id(self, participant_id):
+        """Return the ID of the roommate after the given one, wrapping around"""
+        ids = self.ids()
+        if participant_id not in ids:
+            return ids[0]
+        return ids[(ids.index(participant_id) + 1) % len(ids)]
+
+    def to_list(self):
+        return [dict(participant) for participant in self.participants]
+
+    def __len__(self):
+        return len(self.participants)
+
+    def __iter__(self):
+        return iter(self.participants)
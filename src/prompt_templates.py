@@ -0,0 +1,143 @@
+import json
+from functools import lru_cache
+import context_engine
+import summarizer
+
+# System message that instructs the model how to behave
+SYSTEM_PROMPT = """You are a skilled and empathetic roommate mediator with years of experience helping people navigate shared living situations.
+Your role is to facilitate a constructive conversation between roommates who are seeking help with their living arrangement issues.
+- Always maintain a neutral, non-judgmental stance
+- Recognize and acknowledge the feelings of every roommate
+- Help identify common roommate problems like chore distribution, noise levels, personal space, shared expenses, and guest policies
+- Suggest practical solutions for common roommate conflicts
+- Ask clarifying questions when needed
+- Provide insights based on what you've heard from each roommate
+- Remember details about each roommate and reference them appropriately
+- Recognize who is currently speaking to you
+
+You should address the current speaker directly while keeping in mind the context of the entire conversation.
+"""
+
+SPEAKER_NOTE = "The current speaker is {speaker}. Address your response to them specifically."
+SUMMARY_NOTE = "Summary of the earlier conversation:\n{summary}"
+
+# Tokens set aside for the trailing "current speaker" system message
+SPEAKER_NOTE_TOKENS = 32
+
+# Built and serialized once per process. Prompts share these dicts, so they
+# must never be modified.
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+SYSTEM_FRAGMENT = json.dumps(SYSTEM_MESSAGE)
+
+
+class Prompt(list):
+    """
+    A list of chat messages that also carries each message's JSON encoding,
+    so request bodies can be assembled without re-encoding the history.
+    """
+
+    def __init__(self, messages=(), fragments=()):
+        super().__init__(messages)
+        self.fragments = list(fragments)
+
+    def add(self, message, fragment=None):
+        self.append(message)
+        self.fragments.append(fragment if fragment is not None else json.dumps(message))
+
+
+@lru_cache(maxsize=None)
+def reserved_tokens(model):
+    """Tokens taken by the pinned system prompt and speaker note, counted once per model"""
+    return context_engine.count_tokens(SYSTEM_PROMPT, model) + SPEAKER_NOTE_TOKENS
+
+
+@lru_cache(maxsize=256)
+def speaker_note(speaker):
+    """Return the speaker instruction message and its JSON for a roommate"""
+    message = {"role": "system", "content": SPEAKER_NOTE.format(speaker=speaker)}
+    return message, json.dumps(message)
+
+
+@lru_cache(maxsize=64)
+def summary_note(summary):
+    """Return the summary message and its JSON; summaries change far less often than turns"""
+    message = {"role": "system", "content": SUMMARY_NOTE.format(summary=summary)}
+    return message, json.dumps(message)
+
+
+def format_message(msg):
+    """Convert a stored chat message into a chat API message, or None to skip it"""
+    if msg["role"] == "user":
+        # Content is already in the "**Speaker**: message" format
+        return {"role": "user", "content": msg["content"]}
+    elif msg["role"] == "assistant":
+        return {"role": "assistant", "content": msg["content"]}
+    return None
+
+
+def new_context(model, complete, summarize=True, rolling_summary=None):
+    """
+    Create an incremental context for one session with `model`. Keep it
+    alongside the session's messages and pass it to prepare_therapy_context
+    every turn.
+
+    With SUMMARIZE_HISTORY on, the context gets its own rolling summarizer
+    calling `complete`, unless summarize is False or a shared one is passed in.
+    """
+    if rolling_summary is None and summarize and summarizer.summarization_enabled():
+        rolling_summary = summarizer.RollingSummarizer(complete)
+    return context_engine.ConversationContext(
+        format_message, model, reserved_tokens=reserved_tokens(model), summarizer=rolling_summary
+    )
+
+
+def prepare_therapy_context(messages, current_speaker, context=None, model=None):
+    """
+    Prepare the prompt for a turn: the conversation history and who is
+    currently speaking. With a context from new_context(), only messages
+    added since the last call are formatted and the history is trimmed to
+    the model's token budget. Without one, a throwaway context for `model`
+    is used; it never summarizes, as the summary would be lost.
+    """
+    if context is None:
+        context = new_context(model, None, summarize=False)
+    context.sync(messages)
+    return build_prompt(context, current_speaker)
+
+
+def build_prompt(context, current_speaker):
+    """
+    Assemble the prompt for a turn: system prompt, optional summary of
+    older turns, the history window and the speaker note. Every piece comes
+    with its cached JSON; only new history entries are ever encoded.
+    """
+    prompt = Prompt()
+    prompt.add(SYSTEM_MESSAGE, SYSTEM_FRAGMENT)
+
+    # Older turns that have been rolled up are replaced by their summary
+    summary = context.summary()
+    if summary:
+        prompt.add(*summary_note(summary))
+
+    prompt.extend(context.window())
+    prompt.fragments.extend(context.window_fragments())
+
+    # Add information about who is currently speaking
+    prompt.add(*speaker_note(current_speaker))
+    return prompt
+
+
+def render_body(payload):
+    """
+    Serialize a request payload to JSON bytes. When its "messages" is a
+    Prompt, the cached message fragments are spliced in instead of
+    encoding the whole conversation again.
+    """
+    messages = payload.get("messages")
+    if not isinstance(messages, Prompt):
+        return json.dumps(payload).encode()
+
+    fields = {key: value for key, value in payload.items() if key != "messages"}
+    head = json.dumps(fields)[:-1]
+    separator = ", " if fields else ""
+    return f'{head}{separator}"messages": [{", ".join(messages.fragments)}]}}'.encode()
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Replays should reach the model every turn and see the history as recorded
+os.environ.setdefault("RESPONSE_CACHE", "0")
+os.environ.setdefault("SUMMARIZE_HISTORY", "0")
+
+import metrics
+import benchmark
+import context_engine
+import mock_llm_server
+from transcript_archive import TranscriptReader
+
+
+def voice_turns(transcript):
+    """User messages for a transcript's voice segments, in the app's "**Speaker**: text" format"""
+    return [
+        {"role": "user", "speaker": segment["speaker"], "content": f"**{segment['speaker']}**: {segment['text']}"}
+        for segment in transcript["voice_segments"] if segment.get("text")
+    ]
+
+
+def prompt_tokens(prompt, model):
+    return sum(context_engine.count_tokens(message["content"], model) for message in prompt)
+
+
+def replay_transcript(client, transcript, stream=False, live=False, use_voice=False):
+    """
+    Send every user turn of a recorded session through prepare_therapy_context
+    and the client, as the app would have. By default the model sees the
+    recorded replies as history; with live=True it sees its own instead.
+    Returns one result dict per turn.
+    """
+    recorded = transcript["messages"]
+    if use_voice and transcript["voice_segments"]:
+        # Spoken turns have no recorded replies to pair with, so the model answers each one
+        recorded = [message for message in recorded if message["role"] != "user"][:1] + voice_turns(transcript)
+        live = True
+
+    context = client.new_context()
+    messages = []
+    results = []
+    for position, message in enumerate(recorded):
+        if message["role"] != "user":
+            # Once the model is answering for itself, its replies stand in for the recorded ones
+            if not (live and results):
+                messages.append(message)
+            continue
+
+        messages.append(message)
+        speaker = message.get("speaker", "")
+        started = time.perf_counter()
+        prompt = client.prepare_therapy_context(messages, speaker, context=context)
+        try:
+            reply = "".join(client.stream_response(prompt)) if stream else client.get_response(prompt)
+        except Exception as e:
+            reply = f"Error: {e}"
+        elapsed = time.perf_counter() - started
+        metrics.record("replay.turn", elapsed)
+
+        following = recorded[position + 1] if position + 1 < len(recorded) else None
+        failed = reply.startswith("Error") or reply.startswith("Unexpected error")
+        results.append({
+            "session_id": transcript["session_id"],
+            "turn": len(results),
+            "speaker": speaker,
+            "recorded_reply": following["content"] if following and following["role"] == "assistant" else None,
+            "reply": reply,
+            "failed": failed,
+            "prompt_tokens": prompt_tokens(prompt, client.MODEL_NAME),
+            "completion_tokens": 0 if failed else context_engine.count_tokens(reply, client.MODEL_NAME),
+            "seconds": elapsed,
+        })
+        if live:
+            messages.append({"role": "assistant", "content": reply})
+    return results
+
+
+def replay_archive(client, reader, concurrency, limit=None, on_results=None, **options):
+    """
+    Replay the archive's transcripts on `concurrency` threads. Transcripts are
+    read as workers free up, so the archive is never decoded all at once.
+    Returns the totals; each transcript's turn results go to on_results.
+    """
+    totals = {"sessions": 0, "turns": 0, "failed_turns": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    lock = threading.Lock()
+
+    def run(number):
+        results = replay_transcript(client, reader[number], **options)
+        with lock:
+            totals["sessions"] += 1
+            totals["turns"] += len(results)
+            totals["failed_turns"] += sum(result["failed"] for result in results)
+            totals["prompt_tokens"] += sum(result["prompt_tokens"] for result in results)
+            totals["completion_tokens"] += sum(result["completion_tokens"] for result in results)
+            if on_results:
+                on_results(results)
+
+    count = len(reader) if limit is None else min(limit, len(reader))
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        for number in range(count):
+            if len(pending) >= concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(pool.submit(run, number))
+        for future in pending:
+            future.result()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay archived sessions through the therapy prompt and an LLM backend")
+    parser.add_argument("archive", help="transcript archive written by transcript_archive.py")
+    parser.add_argument("--backend", choices=sorted(benchmark.CLIENTS), default="openai")
+    parser.add_argument("--concurrency", type=int, default=16, help="sessions replayed at once")
+    parser.add_argument("--limit", type=int, help="replay only the first N sessions")
+    parser.add_argument("--stream", action="store_true", help="stream responses instead of waiting for them")
+    parser.add_argument("--live", action="store_true", help="continue from the model's own replies instead of the recorded ones")
+    parser.add_argument("--voice", action="store_true", help="use voice segments as the user turns when a session has them")
+    parser.add_argument("--mock", action="store_true", help="replay against the local mock server instead of the real API")
+    parser.add_argument("--price-prompt", type=float, default=0.0, help="cost per million prompt tokens")
+    parser.add_argument("--price-completion", type=float, default=0.0, help="cost per million completion tokens")
+    parser.add_argument("--out", help="write every turn's reply and token counts to this JSONL file")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    server = None
+    if args.mock:
+        server = mock_llm_server.start_server(mock_llm_server.MockSettings(tokens_per_sec=200.0, seed=0))
+        benchmark.point_clients_at(f"http://127.0.0.1:{server.server_address[1]}")
+
+    out = open(args.out, "w") if args.out else None
+
+    def write_results(results):
+        if out:
+            for result in results:
+                out.write(json.dumps(result) + "\n")
+
+    client = benchmark.CLIENTS[args.backend]
+    metrics.reset()
+    started = time.perf_counter()
+    try:
+        with TranscriptReader(args.archive) as reader:
+            totals = replay_archive(
+                client, reader, args.concurrency, args.limit, on_results=write_results,
+                stream=args.stream, live=args.live, use_voice=args.voice
+            )
+    finally:
+        if out:
+            out.close()
+        if server:
+            server.shutdown()
+    elapsed = time.perf_counter() - started
+
+    cost = (totals["prompt_tokens"] * args.price_prompt + totals["completion_tokens"] * args.price_completion) / 1e6
+    summary = dict(
+        totals,
+        backend=args.backend,
+        model=client.MODEL_NAME,
+        seconds=elapsed,
+        turns_per_sec=totals["turns"] / elapsed if elapsed else 0.0,
+        estimated_cost=cost,
+        stages=metrics.snapshot()["stages"],
+    )
+
+    print(f"\n== replay: {summary['sessions']} sessions, {summary['turns']} turns on {args.backend} ({client.MODEL_NAME}) ==")
+    print(f"{summary['turns_per_sec']:.1f} turns/s, {summary['failed_turns']} failed, "
+          f"{summary['prompt_tokens']} prompt + {summary['completion_tokens']} completion tokens, "
+          f"estimated cost {cost:.4f}")
+    benchmark.print_stages(summary["stages"])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
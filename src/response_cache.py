@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Set RESPONSE_CACHE=false to turn caching off
+CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "true").lower() not in ("0", "false", "no")
+# Entries older than this many seconds are treated as misses
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Maximum entries held in memory
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+# Optional SQLite file for a persistent second tier
+CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH")
+# Maximum rows kept in the on-disk tier
+CACHE_MAX_DISK_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_DISK_ENTRIES", "100000"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(value):
+    """Collapse insignificant whitespace so trivially different requests share a key"""
+    if isinstance(value, str):
+        return _WHITESPACE.sub(" ", value).strip()
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def make_key(payload):
+    """Hash a request payload (model, parameters and messages) into a cache key"""
+    serialized = json.dumps(_normalize(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier response cache: an in-process LRU in front of an optional
+    SQLite file. Both tiers expire entries after the TTL and evict the
+    oldest entries once they are full.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, path=CACHE_PATH,
+                 max_disk_entries=CACHE_MAX_DISK_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()  # key -> (stored_at, response)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, stored_at REAL NOT NULL, response TEXT NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)")
+            self.db.commit()
+
+    def get(self, key):
+        """Return the cached response for a key, or None"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT stored_at, response FROM responses WHERE key = ? AND stored_at >= ?",
+                    (key, now - self.ttl)
+                ).fetchone()
+                if row is not None:
+                    # Promote to the memory tier
+                    self._store_memory(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return row[1]
+
+            self.misses += 1
+            return None
+
+    def set(self, key, response):
+        """Store a response in both tiers"""
+        now = time.time()
+        with self.lock:
+            self._store_memory(key, now, response)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO responses (key, stored_at, response) VALUES (?, ?, ?)",
+                    (key, now, response)
+                )
+                # Drop expired rows and anything beyond the size limit
+                self.db.execute("DELETE FROM responses WHERE stored_at < ?", (now - self.ttl,))
+                self.db.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+                self.db.commit()
+
+    def _store_memory(self, key, stored_at, response):
+        self.entries[key] = (stored_at, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM responses")
+                self.db.commit()
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+            }
@@ -0,0 +1,144 @@
+import os
+import time
+import threading
+from collections import deque
+
+# Turns a room may start per minute; bursts up to ROOM_BURST are allowed
+ROOM_TURNS_PER_MINUTE = float(os.getenv("ROOM_TURNS_PER_MINUTE", "30"))
+ROOM_BURST = int(os.getenv("ROOM_BURST", "3"))
+# Replies one room may have generating at once, so a busy house can't hold every worker
+ROOM_MAX_CONCURRENT = int(os.getenv("ROOM_MAX_CONCURRENT", "2"))
+# Per-room priorities, e.g. ROOM_PRIORITIES=house-12=2,house-7=1 (higher is served first, default 0)
+ROOM_PRIORITIES = {
+    room.split("=", 1)[0].strip(): int(room.split("=", 1)[1])
+    for room in os.getenv("ROOM_PRIORITIES", "").split(",") if "=" in room
+}
+
+
+class _Room:
+    def __init__(self, room_id, priority, rate, burst):
+        self.room_id = room_id
+        self.priority = priority
+        self.rate = rate / 60.0  # tokens per second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.queue = deque()
+        self.inflight = 0
+        self.last_served = 0.0
+        self.served = 0
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def ready_in(self, now):
+        """Seconds until this room may start its next item (0 if it can now)"""
+        if self.rate <= 0 or self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FairScheduler:
+    """
+    Shares worker capacity between rooms.
+
+    Each room has its own queue, a token-bucket rate limit and a cap on
+    items in flight. get() hands out the next item from the highest
+    priority room that is allowed to start one, taking turns between
+    rooms of equal priority so one household can't starve the others.
+    Call done(room_id) when an item finishes.
+    """
+
+    def __init__(self, rate=ROOM_TURNS_PER_MINUTE, burst=ROOM_BURST, max_concurrent=ROOM_MAX_CONCURRENT, priorities=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.priorities = dict(ROOM_PRIORITIES if priorities is None else priorities)
+        self.rooms = {}
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def _room(self, room_id):
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = _Room(room_id, self.priorities.get(room_id, 0), self.rate, self.burst)
+        return room
+
+    def set_priority(self, room_id, priority):
+        with self.cond:
+            self.priorities[room_id] = priority
+            self._room(room_id).priority = priority
+            self.cond.notify_all()
+
+    def put(self, room_id, item):
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("Scheduler is closed")
+            self._room(room_id).queue.append(item)
+            self.cond.notify()
+
+    def get(self):
+        """Block until an item may start and return (room_id, item); None once closed"""
+        with self.cond:
+            while True:
+                if self.closed:
+                    return None
+                now = time.monotonic()
+                candidates = []
+                idle = []
+                wait = None
+                for room in self.rooms.values():
+                    room.refill(now)
+                    if not room.queue and not room.inflight and room.tokens >= room.burst:
+                        idle.append(room.room_id)
+                    if not room.queue or room.inflight >= self.max_concurrent:
+                        continue
+                    delay = room.ready_in(now)
+                    if delay:
+                        wait = delay if wait is None else min(wait, delay)
+                        continue
+                    candidates.append(room)
+                # Idle rooms with a full bucket are forgotten; a new one would start the same way
+                for room_id in idle:
+                    del self.rooms[room_id]
+
+                if candidates:
+                    # Highest priority first, then whichever room has waited longest since it was served
+                    room = min(candidates, key=lambda room: (-room.priority, room.last_served))
+                    if room.rate > 0:
+                        room.tokens -= 1
+                    room.inflight += 1
+                    room.served += 1
+                    room.last_served = now
+                    return room.room_id, room.queue.popleft()
+
+                # Sleep until a rate limit refills, or until put() or done() changes things
+                self.cond.wait(wait)
+
+    def done(self, room_id):
+        """Mark an item from a room as finished, freeing its concurrency slot"""
+        with self.cond:
+            room = self.rooms.get(room_id)
+            if room is not None:
+                room.inflight -= 1
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def stats(self):
+        """Priority, queue length, in-flight and served counts per room"""
+        with self.cond:
+            return {
+                room.room_id: {
+                    "priority": room.priority,
+                    "queued": len(room.queue),
+                    "inflight": room.inflight,
+                    "served": room.served,
+                }
+                for room in self.rooms.values()
+            }
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Which store to use ("sqlite" or "memory")
+SESSION_STORE = os.getenv("SESSION_STORE", "sqlite")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+# Number of most recent messages loaded when a session is resumed
+SESSION_WINDOW = int(os.getenv("SESSION_WINDOW", "50"))
+# Buffered messages are written once this many are pending or this many seconds have passed
+BATCH_SIZE = int(os.getenv("SESSION_BATCH_SIZE", "16"))
+BATCH_INTERVAL = float(os.getenv("SESSION_BATCH_INTERVAL", "2"))
+
+
+class SessionStore:
+    """
+    Append-only storage for chat sessions.
+
+    Messages are buffered in memory and written in batches; call flush()
+    at the end of a turn to make them durable. Each stored message gets an
+    increasing "id" that can be used to page backwards through a session.
+    """
+
+    def __init__(self):
+        self.pending = []  # (session_id, message)
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def append(self, session_id, message):
+        """Queue a message for the session, flushing if the batch is full or old"""
+        with self.lock:
+            self.pending.append((session_id, dict(message)))
+            due = len(self.pending) >= BATCH_SIZE or time.monotonic() - self.last_flush >= BATCH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write all pending messages in one batch"""
+        with self.lock:
+            batch, self.pending = self.pending, []
+            self.last_flush = time.monotonic()
+            if batch:
+                self._write(batch)
+
+    def load_recent(self, session_id, limit=SESSION_WINDOW):
+        """Return the newest messages of a session, oldest first"""
+        self.flush()
+        return self._read(session_id, None, limit)
+
+    def load_before(self, session_id, before_id, limit=SESSION_WINDOW):
+        """Return up to `limit` messages older than the given message id, oldest first"""
+        self.flush()
+        return self._read(session_id, before_id, limit)
+
+    def save_session(self, session_id, info):
+        """Store session-level details such as roommate names"""
+        raise NotImplementedError
+
+    def load_session(self, session_id):
+        """Return the session-level details, or None for an unknown session"""
+        raise NotImplementedError
+
+    def list_sessions(self):
+        """Return the IDs of all sessions with stored messages"""
+        raise NotImplementedError
+
+    def append_voice_segments(self, session_id, segments):
+        """Store diarized voice segments ({"speaker", "start", "end", "text"}) for a session"""
+        raise NotImplementedError
+
+    def load_voice_segments(self, session_id):
+        """Return every stored voice segment of a session, oldest first"""
+        raise NotImplementedError
+
+    def _write(self, batch):
+        raise NotImplementedError
+
+    def _read(self, session_id, before_id, limit):
+        raise NotImplementedError
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite store in WAL mode, so several Streamlit processes on the same
+    host can read and append to the same database concurrently.
+    """
+
+    def __init__(self, path=SESSION_DB_PATH):
+        super().__init__()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db_lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "session_id TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "message TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, "
+            "updated_at REAL NOT NULL, "
+            "info TEXT NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS voice_segments ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "session_id TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "segment TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS voice_segments_session ON voice_segments (session_id, id)")
+        self.db.commit()
+
+    def _write(self, batch):
+        now = time.time()
+        with self.db_lock:
+            self.db.executemany(
+                "INSERT INTO messages (session_id, created_at, message) VALUES (?, ?, ?)",
+                [(session_id, now, json.dumps(message)) for session_id, message in batch]
+            )
+            self.db.commit()
+
+    def _read(self, session_id, before_id, limit):
+        with self.db_lock:
+            if before_id is None:
+                rows = self.db.execute(
+                    "SELECT id, message FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                    (session_id, limit)
+                ).fetchall()
+            else:
+                rows = self.db.execute(
+                    "SELECT id, message FROM messages WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                    (session_id, before_id, limit)
+                ).fetchall()
+        messages = []
+        for message_id, data in reversed(rows):
+            message = json.loads(data)
+            message["id"] = message_id
+            messages.append(message)
+        return messages
+
+    def save_session(self, session_id, info):
+        with self.db_lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, updated_at, info) VALUES (?, ?, ?)",
+                (session_id, time.time(), json.dumps(info))
+            )
+            self.db.commit()
+
+    def load_session(self, session_id):
+        with self.db_lock:
+            row = self.db.execute("SELECT info FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_sessions(self):
+        self.flush()
+        with self.db_lock:
+            rows = self.db.execute("SELECT DISTINCT session_id FROM messages ORDER BY session_id").fetchall()
+        return [row[0] for row in rows]
+
+    def append_voice_segments(self, session_id, segments):
+        now = time.time()
+        with self.db_lock:
+            self.db.executemany(
+                "INSERT INTO voice_segments (session_id, created_at, segment) VALUES (?, ?, ?)",
+                [(session_id, now, json.dumps(segment)) for segment in segments]
+            )
+            self.db.commit()
+
+    def load_voice_segments(self, session_id):
+        with self.db_lock:
+            rows = self.db.execute(
+                "SELECT created_at, segment FROM voice_segments WHERE session_id = ? ORDER BY id",
+                (session_id,)
+            ).fetchall()
+        return [dict(json.loads(segment), recorded_at=created_at) for created_at, segment in rows]
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store for development; nothing survives a restart"""
+
+    def __init__(self):
+        super().__init__()
+        self.messages = {}  # session_id -> list of messages
+        self.sessions = {}
+        self.voice_segments = {}  # session_id -> list of segments
+        self.next_id = 1
+
+    def _write(self, batch):
+        for session_id, message in batch:
+            message["id"] = self.next_id
+            self.next_id += 1
+            self.messages.setdefault(session_id, []).append(message)
+
+    def _read(self, session_id, before_id, limit):
+        messages = self.messages.get(session_id, [])
+        if before_id is not None:
+            messages = [message for message in messages if message["id"] < before_id]
+        return [dict(message) for message in messages[-limit:]]
+
+    def save_session(self, session_id, info):
+        self.sessions[session_id] = dict(info)
+
+    def load_session(self, session_id):
+        info = self.sessions.get(session_id)
+        return dict(info) if info is not None else None
+
+    def list_sessions(self):
+        self.flush()
+        return sorted(self.messages)
+
+    def append_voice_segments(self, session_id, segments):
+        now = time.time()
+        self.voice_segments.setdefault(session_id, []).extend(
+            dict(segment, recorded_at=now) for segment in segments
+        )
+
+    def load_voice_segments(self, session_id):
+        return [dict(segment) for segment in self.voice_segments.get(session_id, [])]
+
+
+STORES = {
+    "sqlite": SQLiteSessionStore,
+    "memory": MemorySessionStore,
+}
+
+_store = None
+_lock = threading.Lock()
+
+
+def register_store(name, store_class):
+    """Make a custom SessionStore subclass selectable through SESSION_STORE"""
+    STORES[name] = store_class
+
+
+def get_store():
+    """Return the process-wide session store configured by SESSION_STORE"""
+    global _store
+    with _lock:
+        if _store is None:
+            if SESSION_STORE not in STORES:
+                raise ValueError(f"Unknown session store: {SESSION_STORE}")
+            _store = STORES[SESSION_STORE]()
+        return _store
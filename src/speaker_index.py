@@ -0,0 +1,121 @@
+import threading
+
+# Cosine similarity above which a voice is taken to be an enrolled roommate
+MATCH_THRESHOLD = 0.5
+# Recordings per roommate before segments can be classified without full diarization
+CLASSIFY_AFTER = 2
+
+
+def _normalize(vectors):
+    import numpy as np
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-9)
+
+
+class SpeakerIndex:
+    """
+    Per-session voice index mapping speaker embeddings to roommate names.
+
+    Each roommate has a centroid embedding, updated incrementally as new
+    recordings are matched to them. The first voices heard are enrolled in
+    the order the names are given.
+    """
+
+    def __init__(self, names, threshold=MATCH_THRESHOLD):
+        self.names = list(names)
+        self.threshold = threshold
+        # numpy is only imported once a voice is heard, so sessions without
+        # speaker identification never load it
+        self.centroids = None  # (roommates, dim), allocated on the first embedding
+        self.counts = None  # recordings per roommate, allocated with the centroids
+        self.lock = threading.Lock()
+
+    @property
+    def ready(self):
+        """True once every roommate has enough recordings to classify against"""
+        return self.counts is not None and bool((self.counts >= CLASSIFY_AFTER).all())
+
+    def rename(self, names):
+        """
+        Update the roommate names seat by seat, keeping their enrolled
+        voices. Added seats start empty; voices of removed seats are dropped.
+        """
+        with self.lock:
+            names = list(names)
+            if self.centroids is not None:
+                import numpy as np
+                size = len(names)
+                kept = min(size, len(self.names))
+                counts = np.zeros(size, dtype=np.int64)
+                counts[:kept] = self.counts[:kept]
+                centroids = np.zeros((size, self.centroids.shape[1]))
+                centroids[:kept] = self.centroids[:kept]
+                self.counts = counts
+                self.centroids = centroids
+            self.names = names
+
+    def _similarities(self, embeddings):
+        """Cosine similarity of each embedding to each centroid; -inf for empty slots"""
+        sims = _normalize(embeddings) @ _normalize(self.centroids).T
+        sims[:, self.counts == 0] = float("-inf")
+        return sims
+
+    def _update(self, slot, embedding):
+        self.counts[slot] += 1
+        self.centroids[slot] += (embedding - self.centroids[slot]) / self.counts[slot]
+
+    def assign(self, embeddings):
+        """
+        Map the embeddings of the distinct speakers in one recording to
+        roommate names, keeping the speakers apart. Unmatched voices are
+        enrolled into free slots. Returns one name per embedding.
+        """
+        import numpy as np
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float64))
+        with self.lock:
+            if self.centroids is None:
+                self.centroids = np.zeros((len(self.names), embeddings.shape[1]))
+                self.counts = np.zeros(len(self.names), dtype=np.int64)
+            sims = self._similarities(embeddings)
+
+            slots = [None] * len(embeddings)
+            used = set()
+            # Greedily take the most similar (speaker, roommate) pairs first
+            for flat in np.argsort(sims, axis=None)[::-1]:
+                i, j = np.unravel_index(flat, sims.shape)
+                if sims[i, j] < self.threshold:
+                    break
+                if slots[i] is None and j not in used:
+                    slots[i] = j
+                    used.add(j)
+
+            for i in range(len(embeddings)):
+                if slots[i] is not None:
+                    continue
+                free = [j for j in range(len(self.names)) if self.counts[j] == 0 and j not in used]
+                if free:
+                    slots[i] = free[0]
+                else:
+                    # More voices than roommates: fall back to the nearest one
+                    slots[i] = int(np.argmax(sims[i]))
+                used.add(slots[i])
+
+            for i, slot in enumerate(slots):
+                self._update(slot, embeddings[i])
+            return [self.names[slot] for slot in slots]
+
+    def classify(self, embeddings):
+        """
+        Label each embedding with the nearest enrolled roommate, e.g. one
+        per window of a recording. Returns one name per embedding.
+        """
+        import numpy as np
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float64))
+        with self.lock:
+            sims = self._similarities(embeddings)
+            slots = np.argmax(sims, axis=1)
+            for i, slot in enumerate(slots):
+                # Only confident matches refine the centroid
+                if sims[i, slot] >= self.threshold:
+                    self._update(slot, embeddings[i])
+            return [self.names[slot] for slot in slots]
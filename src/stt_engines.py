@@ -0,0 +1,203 @@
+import os
+import json
+import threading
+import speech_recognition as sr
+
+# Local engines are optional and only imported when selected by STT_ENGINE,
+# so processes that never transcribe don't pay for loading them
+
+# Which engine transcribes speech ("google", "vosk", "whisper" or "fake")
+STT_ENGINE = os.environ.get("STT_ENGINE", "google")
+VOSK_MODEL_PATH = os.environ.get("VOSK_MODEL_PATH", "models/vosk-model-small-en-us-0.15")
+WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "base.en")
+WHISPER_COMPUTE_TYPE = os.environ.get("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_BATCH_SIZE = int(os.environ.get("WHISPER_BATCH_SIZE", "8"))
+# Seconds a network engine may spend on one utterance
+OPERATION_TIMEOUT = float(os.environ.get("SEGMENT_TIMEOUT", "15"))
+
+# Local engines expect 16 kHz, 16-bit mono audio
+ENGINE_SAMPLE_RATE = 16000
+# Silence inserted between utterances when several are batched into one pass
+BATCH_GAP_SECONDS = 1.0
+
+
+class SpeechEngine:
+    """
+    Interface for speech-to-text engines.
+
+    transcribe() takes an sr.AudioData and returns the recognized text, or
+    an empty string if nothing was understood. Engines that can process
+    several utterances in one pass set batch_size above 1 and override
+    transcribe_batch().
+    """
+
+    name = None
+    batch_size = 1
+
+    def transcribe(self, audio_data):
+        raise NotImplementedError
+
+    def transcribe_batch(self, audio_list):
+        return [self.transcribe(audio_data) for audio_data in audio_list]
+
+
+def _to_pcm(audio_data):
+    """
+    Convert sr.AudioData to 16 kHz 16-bit PCM bytes. Audio that is already
+    in that format comes back as the memoryview it was built from, which
+    C bindings such as vosk's don't accept, so it is copied once here.
+    """
+    raw = audio_data.get_raw_data(convert_rate=ENGINE_SAMPLE_RATE, convert_width=2)
+    return raw if isinstance(raw, bytes) else bytes(raw)
+
+
+def _to_samples(audio_data):
+    """Convert sr.AudioData to 16 kHz float32 samples in [-1, 1]"""
+    import numpy as np
+    raw = audio_data.get_raw_data(convert_rate=ENGINE_SAMPLE_RATE, convert_width=2)
+    return np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+class GoogleEngine(SpeechEngine):
+    """Google Web Speech API through speech_recognition (needs network access)"""
+
+    name = "google"
+
+    def __init__(self, recognizer=None):
+        self.recognizer = recognizer or sr.Recognizer()
+        self.recognizer.operation_timeout = OPERATION_TIMEOUT
+
+    def transcribe(self, audio_data):
+        try:
+            return self.recognizer.recognize_google(audio_data)
+        except sr.UnknownValueError:
+            return ""
+
+
+class VoskEngine(SpeechEngine):
+    """Offline Kaldi-based recognition; the model is loaded once and shared"""
+
+    name = "vosk"
+
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        import vosk
+        self.vosk = vosk
+        vosk.SetLogLevel(-1)
+        self.model = vosk.Model(model_path)
+
+    def transcribe(self, audio_data):
+        # Recognizers are cheap; the model behind them is what is expensive to load
+        recognizer = self.vosk.KaldiRecognizer(self.model, ENGINE_SAMPLE_RATE)
+        recognizer.AcceptWaveform(_to_pcm(audio_data))
+        return json.loads(recognizer.FinalResult()).get("text", "")
+
+
+class WhisperEngine(SpeechEngine):
+    """
+    Offline Whisper on CPU via faster-whisper. Batches are transcribed in a
+    single pass by joining the utterances with short silences and splitting
+    the words back out by timestamp.
+    """
+
+    name = "whisper"
+    batch_size = WHISPER_BATCH_SIZE
+
+    def __init__(self, model_name=WHISPER_MODEL, compute_type=WHISPER_COMPUTE_TYPE):
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(model_name, device="cpu", compute_type=compute_type)
+        # CTranslate2 models are not safe to call from several threads at once
+        self.lock = threading.Lock()
+
+    def transcribe(self, audio_data):
+        with self.lock:
+            segments, _ = self.model.transcribe(_to_samples(audio_data), beam_size=1)
+            return " ".join(segment.text.strip() for segment in segments).strip()
+
+    def transcribe_batch(self, audio_list):
+        if len(audio_list) == 1:
+            return [self.transcribe(audio_list[0])]
+
+        import numpy as np
+        gap = np.zeros(int(BATCH_GAP_SECONDS * ENGINE_SAMPLE_RATE), dtype=np.float32)
+        pieces = []
+        bounds = []  # (start, end) of each utterance in the joined audio, in seconds
+        offset = 0.0
+        for audio_data in audio_list:
+            samples = _to_samples(audio_data)
+            duration = len(samples) / ENGINE_SAMPLE_RATE
+            bounds.append((offset, offset + duration))
+            pieces.extend([samples, gap])
+            offset += duration + BATCH_GAP_SECONDS
+
+        with self.lock:
+            segments, _ = self.model.transcribe(np.concatenate(pieces), beam_size=1, word_timestamps=True)
+            words = [word for segment in segments for word in (segment.words or [])]
+
+        texts = [[] for _ in audio_list]
+        for word in words:
+            midpoint = (word.start + word.end) / 2
+            for i, (start, end) in enumerate(bounds):
+                if midpoint < end + BATCH_GAP_SECONDS / 2:
+                    if midpoint >= start - BATCH_GAP_SECONDS / 2:
+                        texts[i].append(word.word.strip())
+                    break
+        return [" ".join(text) for text in texts]
+
+
+class FakeEngine(SpeechEngine):
+    """
+    Deterministic engine for tests and benchmarks. Returns the given
+    responses in turn, or a description of the audio length.
+    """
+
+    name = "fake"
+
+    def __init__(self, responses=None):
+        self.responses = list(responses or [])
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def transcribe(self, audio_data):
+        with self.lock:
+            index = self.calls
+            self.calls += 1
+        if self.responses:
+            return self.responses[index % len(self.responses)]
+        seconds = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+        return f"utterance {index + 1} ({seconds:.1f}s)"
+
+
+ENGINES = {
+    "google": GoogleEngine,
+    "vosk": VoskEngine,
+    "whisper": WhisperEngine,
+    "fake": FakeEngine,
+}
+
+_engine = None
+_lock = threading.Lock()
+
+
+def register_engine(name, engine_class):
+    """Make a custom SpeechEngine subclass selectable through STT_ENGINE"""
+    ENGINES[name] = engine_class
+
+
+def get_engine():
+    """Return the process-wide engine selected by STT_ENGINE, loading its model on first use"""
+    global _engine
+    with _lock:
+        if _engine is None:
+            try:
+                _engine = ENGINES[STT_ENGINE]()
+            except (KeyError, ImportError, OSError, RuntimeError) as e:
+                print(f"Warning: Could not load speech engine '{STT_ENGINE}' ({e}). Falling back to Google Speech Recognition.")
+                _engine = GoogleEngine()
+        return _engine
+
+
+def set_engine(engine):
+    """Replace the process-wide engine, e.g. with a FakeEngine in tests"""
+    global _engine
+    with _lock:
+        _engine = engine
@@ -0,0 +1,134 @@
+import os
+import re
+import threading
+import context_engine
+
+# Roll older turns into summaries once the history window passes this many tokens
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "2000"))
+# Number of most recent tokens that are always sent verbatim
+SUMMARY_KEEP_TOKENS = int(os.getenv("SUMMARY_KEEP_TOKENS", "1000"))
+
+SUMMARY_PROMPT = """You are keeping running notes for a roommate mediation session.
+
+Current notes about {speaker}:
+{summary}
+
+New part of the conversation:
+{transcript}
+
+Rewrite the notes about {speaker} so they include anything new from this part of the conversation: their complaints, feelings, requests, and anything they agreed to or the therapist suggested to them. Keep the notes under 120 words. Reply with the notes only."""
+
+SPEAKER_PATTERN = re.compile(r"^\*\*(.+?)\*\*:")
+
+
+def summarization_enabled():
+    """Return True if rolling summarization is switched on via SUMMARIZE_HISTORY"""
+    return os.getenv("SUMMARIZE_HISTORY", "").lower() in ("1", "true", "yes")
+
+
+def _entry_text(formatted):
+    """Turn a formatted OpenAI message or transcript line into a transcript line"""
+    if isinstance(formatted, dict):
+        if formatted["role"] == "assistant":
+            return f"Therapist: {formatted['content']}"
+        return formatted["content"]
+    return formatted
+
+
+class RollingSummarizer:
+    """
+    Per-session rolling summary of the oldest turns, kept per roommate.
+
+    When the history window grows past the trigger, the turns that fall
+    outside the most recent SUMMARY_KEEP_TOKENS are handed to a background
+    thread that folds them into each roommate's running summary. Turns only
+    leave the prompt once a summary covering them is ready, so the main
+    request never waits on a summarization call.
+    """
+
+    def __init__(self, complete, trigger_tokens=SUMMARY_TRIGGER_TOKENS, keep_tokens=SUMMARY_KEEP_TOKENS):
+        self.complete = complete
+        self.trigger_tokens = trigger_tokens
+        self.keep_tokens = keep_tokens
+        self.lock = threading.Lock()
+        self.summaries = {}        # speaker -> running summary
+        self.summarized_upto = 0   # number of context entries covered by the summaries
+        self.tokens = 0            # token count of the rendered summary
+        self.generation = 0        # bumped on reset so stale background results are dropped
+        self.worker = None
+
+    def reset(self):
+        with self.lock:
+            self.summaries = {}
+            self.summarized_upto = 0
+            self.tokens = 0
+            self.generation += 1
+            self.worker = None
+
+    def render(self, summaries=None):
+        """Return the summaries as prompt text, or an empty string if there are none"""
+        summaries = self.summaries if summaries is None else summaries
+        return "\n".join(f"- {speaker}: {summary}" for speaker, summary in summaries.items())
+
+    def update(self, context):
+        """Apply any finished summary to the context and start a new one if needed"""
+        with self.lock:
+            summarized_upto = self.summarized_upto
+            busy = self.worker is not None and self.worker.is_alive()
+
+        # Turns covered by the summary no longer need to be sent verbatim
+        context.advance(summarized_upto)
+
+        if busy or context.window_tokens <= self.trigger_tokens:
+            return
+
+        # Keep the newest turns verbatim and summarize everything before them
+        cut = len(context.entries)
+        kept = 0
+        while cut > summarized_upto and kept + context.entries[cut - 1][1] <= self.keep_tokens:
+            kept += context.entries[cut - 1][1]
+            cut -= 1
+        if cut <= summarized_upto:
+            return
+
+        lines = [_entry_text(formatted) for formatted, _ in context.entries[summarized_upto:cut]]
+        with self.lock:
+            self.worker = threading.Thread(
+                target=self._summarize,
+                args=(lines, cut, context.model, self.generation),
+                daemon=True
+            )
+            self.worker.start()
+
+    def _summarize(self, lines, upto, model, generation):
+        """Fold a chunk of transcript into the running summaries (runs in the background)"""
+        transcript = "\n".join(lines)
+
+        # Only roommates who spoke in this chunk need their summary updated
+        speakers = []
+        for line in lines:
+            match = SPEAKER_PATTERN.match(line)
+            if match and match.group(1) not in speakers:
+                speakers.append(match.group(1))
+
+        summaries = dict(self.summaries)
+        try:
+            for speaker in speakers:
+                prompt = SUMMARY_PROMPT.format(
+                    speaker=speaker,
+                    summary=summaries.get(speaker, "(none yet)"),
+                    transcript=transcript
+                )
+                summaries[speaker] = self.complete(prompt).strip()
+        except Exception as e:
+            # Leave the turns in the prompt; the next turn will try again
+            print(f"Error updating conversation summary: {e}")
+            return
+
+        tokens = context_engine.count_tokens(self.render(summaries), model)
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.summaries = summaries
+            self.summarized_upto = upto
+            self.tokens = tokens
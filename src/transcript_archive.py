@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+import threading
+
+import session_store
+
+# Start of every archive file, so a wrong path fails loudly instead of misreading
+MAGIC = b"RTA1"
+# Each record in the data file is its length followed by that many bytes of JSON
+LENGTH = struct.Struct("<I")
+# Index entry per record: data offset, record length, message count, export time
+INDEX_ENTRY = struct.Struct("<QIId")
+
+COMPACT_JSON = {"separators": (",", ":"), "ensure_ascii": False}
+
+
+def to_columns(rows):
+    """
+    Turn a list of dicts into {"fields": [...], "columns": [[...], ...]} so
+    keys are written once per transcript instead of once per message.
+    """
+    fields = []
+    for row in rows:
+        for key in row:
+            if key not in fields:
+                fields.append(key)
+    return {"fields": fields, "columns": [[row.get(key) for row in rows] for key in fields]}
+
+
+def from_columns(table):
+    """Rebuild the list of dicts written by to_columns, leaving out missing keys"""
+    rows = [{} for _ in range(len(table["columns"][0]) if table["columns"] else 0)]
+    for key, column in zip(table["fields"], table["columns"]):
+        for row, value in zip(rows, column):
+            if value is not None:
+                row[key] = value
+    return rows
+
+
+class TranscriptWriter:
+    """
+    Appends transcripts to an archive: `path` holds length-prefixed JSON
+    records and `path.idx` a fixed-size entry per record. A record only
+    counts once its index entry is written, so a torn write at the end of
+    the data file is dropped the next time the archive is opened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.lock = threading.Lock()
+        self.data = open(path, "a+b")
+        self.index = open(self.index_path, "a+b")
+        self._recover()
+
+    def _recover(self):
+        self.data.seek(0, os.SEEK_END)
+        if self.data.tell() == 0:
+            self.data.write(MAGIC)
+            self.data.flush()
+        self.data.seek(0)
+        if self.data.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path} is not a transcript archive")
+
+        self.index.seek(0, os.SEEK_END)
+        entries, partial = divmod(self.index.tell(), INDEX_ENTRY.size)
+        if partial:
+            self.index.truncate(entries * INDEX_ENTRY.size)
+        end = len(MAGIC)
+        if entries:
+            self.index.seek((entries - 1) * INDEX_ENTRY.size)
+            offset, length, _, _ = INDEX_ENTRY.unpack(self.index.read(INDEX_ENTRY.size))
+            end = offset + LENGTH.size + length
+        self.data.seek(0, os.SEEK_END)
+        if self.data.tell() > end:
+            self.data.truncate(end)
+
+    def append(self, transcript):
+        """Write one transcript dict and return its record number"""
+        payload = json.dumps(transcript, **COMPACT_JSON).encode()
+        with self.lock:
+            self.data.seek(0, os.SEEK_END)
+            offset = self.data.tell()
+            self.data.write(LENGTH.pack(len(payload)) + payload)
+            self.data.flush()
+            messages = len(transcript["messages"]["columns"][0]) if transcript["messages"]["columns"] else 0
+            self.index.seek(0, os.SEEK_END)
+            self.index.write(INDEX_ENTRY.pack(offset, len(payload), messages, transcript["exported_at"]))
+            self.index.flush()
+            return self.index.tell() // INDEX_ENTRY.size - 1
+
+    def close(self):
+        with self.lock:
+            self.data.close()
+            self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TranscriptReader:
+    """
+    Random access to an archive through memory maps of the data and index
+    files. Records are decoded only when read, so iterating thousands of
+    transcripts keeps one in memory at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data_file = open(path, "rb")
+        self._index_file = open(path + ".idx", "rb")
+        self.data = self._map(self._data_file)
+        self.index = self._map(self._index_file)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a transcript archive")
+
+    @staticmethod
+    def _map(f):
+        # mmap can't map an empty file
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.index) // INDEX_ENTRY.size
+
+    def entry(self, number):
+        """Return (offset, length, messages, exported_at) for a record without decoding it"""
+        if not 0 <= number < len(self):
+            raise IndexError(number)
+        return INDEX_ENTRY.unpack_from(self.index, number * INDEX_ENTRY.size)
+
+    def __getitem__(self, number):
+        offset, length, _, _ = self.entry(number)
+        start = offset + LENGTH.size
+        return decode(json.loads(bytes(self.data[start:start + length])))
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self[number]
+
+    def close(self):
+        for mapped in (self.data, self.index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        self._data_file.close()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def encode(session_id, info, messages, voice_segments):
+    """Build the stored record for one session"""
+    return {
+        "session_id": session_id,
+        "exported_at": time.time(),
+        "info": info or {},
+        "messages": to_columns(messages),
+        "voice_segments": to_columns(voice_segments),
+    }
+
+
+def decode(record):
+    """Turn a stored record back into a transcript with lists of message and segment dicts"""
+    return dict(
+        record,
+        messages=from_columns(record["messages"]),
+        voice_segments=from_columns(record["voice_segments"]),
+    )
+
+
+def load_transcript(store, session_id):
+    """Read a session's full history, details and voice segments from the session store"""
+    messages = store.load_recent(session_id)
+    while messages and messages[0].get("id") is not None:
+        older = store.load_before(session_id, messages[0]["id"])
+        if not older:
+            break
+        messages = older + messages
+    return store.load_session(session_id), messages, store.load_voice_segments(session_id)
+
+
+def export_session(writer, session_id, messages, info=None, voice_segments=()):
+    """Append one session, e.g. from st.session_state.messages, and return its record number"""
+    # Avatars are display-only and identical for every message of a seat
+    rows = [{key: value for key, value in message.items() if key != "avatar"} for message in messages]
+    return writer.append(encode(session_id, info, rows, list(voice_segments)))
+
+
+def export_store(path, session_ids=None, store=None):
+    """Append the given sessions (default: all) from the session store to an archive"""
+    store = store or session_store.get_store()
+    session_ids = session_ids or store.list_sessions()
+    with TranscriptWriter(path) as writer:
+        for session_id in session_ids:
+            info, messages, voice_segments = load_transcript(store, session_id)
+            export_session(writer, session_id, messages, info, voice_segments)
+    return len(session_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stored sessions to a transcript archive, or list one")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="append sessions from the session store")
+    export.add_argument("archive")
+    export.add_argument("--session", action="append", help="session ID to export (repeatable, default: all)")
+    listing = commands.add_parser("list", help="show the transcripts in an archive")
+    listing.add_argument("archive")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        count = export_store(args.archive, args.session)
+        print(f"Exported {count} sessions to {args.archive}")
+        return
+
+    if not os.path.exists(args.archive):
+        sys.exit(f"No archive at {args.archive}")
+    with TranscriptReader(args.archive) as reader:
+        for number in range(len(reader)):
+            _, length, messages, exported_at = reader.entry(number)
+            transcript = reader[number]
+            print(f"{number:>6}  {transcript['session_id']:<36}  {messages:>5} messages  "
+                  f"{len(transcript['voice_segments']):>5} segments  {length:>8} bytes  "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(exported_at))}")
+
+
+if __name__ == "__main__":
+    main()
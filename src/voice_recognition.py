@@ -1,162 +1,656 @@
 import os
 import time
+_import_started = time.perf_counter()
 import threading
-import queue
-import numpy as np
+import importlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import wave
-import pyaudio
+import tempfile
 import speech_recognition as sr
-from pydub import AudioSegment
-import webrtcvad
-import torch
-# Try different import formats for pyannote
-try:
-    from pyannote.audio import Pipeline
-except ImportError:
+import stt_engines
+import metrics
+from diarization_scheduler import DiarizationScheduler
+
+# Heavy dependencies (pyaudio, pydub, webrtcvad, torch/pyannote and local STT
+# models) are loaded on first use, or up front through warm_up()
+
+# Per-session recording state and result channels live in voice_service;
+# this module only holds models and pools shared by every session
+
+# Diarized segments are transcribed concurrently, at most this many at a time
+TRANSCRIBE_WORKERS = int(os.environ.get("TRANSCRIBE_WORKERS", "4"))
+# Seconds a single segment may take before it is dropped
+SEGMENT_TIMEOUT = float(os.environ.get("SEGMENT_TIMEOUT", "15"))
+transcribe_pool = ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS, thread_name_prefix="transcribe")
+# Utterances one streaming recording may have waiting for the pool before its VAD thread waits
+MAX_PENDING_UTTERANCES = 2 * TRANSCRIBE_WORKERS
+
+# Voice activity detection settings for the streaming pipeline
+VAD_AGGRESSIVENESS = 3  # 0-3, 3 filters out the most non-speech
+VAD_FRAME_MS = 30  # webrtcvad accepts 10, 20 or 30 ms frames
+VAD_PADDING_MS = 300  # Window used to decide when an utterance starts and ends
+MAX_UTTERANCE_SECONDS = 15  # Longer utterances are cut so memory stays bounded
+RING_BUFFER_SECONDS = 5  # Audio held between the microphone callback and the VAD
+MAX_RECORDING_SECONDS = 60
+
+# Speaker embedding settings
+MIN_EMBEDDING_SECONDS = 0.5  # Shorter turns give unreliable embeddings
+CLASSIFY_WINDOW_SECONDS = 1.5  # Window size when classifying without diarization
+SILENCE_RMS = 0.01  # Windows quieter than this are skipped
+
+# Time and memory spent loading each heavy component, filled in as they load
+load_stats = {}
+_modules = {}
+_load_lock = threading.Lock()
+
+# Speaker diarization pipeline, shared by all sessions once loaded
+_diarization_pipeline = None
+_diarization_loaded = False
+_diarization_lock = threading.Lock()
+
+# Speaker embedding model, shared by all sessions once loaded
+_embedding_model = None
+_embedding_loaded = False
+_embedding_lock = threading.Lock()
+
+
+def _rss_mb():
+    """Return the resident memory of this process in MB"""
     try:
-        from pyannote_audio import Pipeline
-    except ImportError:
-        print("Warning: Could not import pyannote audio. Speaker diarization will be limited.")
-        Pipeline = None
-from scipy.io import wavfile
-import tempfile
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            # Peak rather than current RSS, but good enough to compare loads
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        except ImportError:
+            return 0.0
+
 
-# Global variables
-audio_queue = queue.Queue()
-is_recording = False
-recognizer = sr.Recognizer()
-vad = webrtcvad.Vad(3)  # Aggressiveness level 3 (highest)
+def _measure(component, load):
+    """Run a loader and record how long it took and how much memory it added"""
+    started = time.perf_counter()
+    rss_before = _rss_mb()
+    result = load()
+    load_stats[component] = {
+        "seconds": time.perf_counter() - started,
+        "rss_mb": _rss_mb() - rss_before
+    }
+    return result
 
-# Initialize speaker diarization pipeline
-diarization_pipeline = None
 
-# Only attempt to initialize if Pipeline is available
-if Pipeline is not None:
+def _lazy_module(name):
+    """Import a heavy dependency on first use"""
+    with _load_lock:
+        if name not in _modules:
+            _modules[name] = _measure(name, lambda: importlib.import_module(name))
+        return _modules[name]
+
+
+def _load_diarization_pipeline():
+    # Try different import formats for pyannote
+    try:
+        from pyannote.audio import Pipeline
+    except ImportError:
+        try:
+            from pyannote_audio import Pipeline
+        except ImportError:
+            print("Warning: Could not import pyannote audio. Speaker diarization will be limited.")
+            print("Warning: PyAnnote Pipeline not available. Using fallback speaker identification.")
+            return None
+    
     try:
         # Check if HuggingFace token is available
         hf_token = os.environ.get("HF_TOKEN")
         if hf_token:
-            diarization_pipeline = Pipeline.from_pretrained(
+            return Pipeline.from_pretrained(
                 "pyannote/speaker-diarization-3.0",
                 use_auth_token=hf_token
             )
-        else:
-            print("Warning: HF_TOKEN not found. Speaker diarization will be limited.")
+        print("Warning: HF_TOKEN not found. Speaker diarization will be limited.")
     except Exception as e:
         print(f"Error loading diarization pipeline: {e}")
-else:
-    print("Warning: PyAnnote Pipeline not available. Using fallback speaker identification.")
+    return None
+
+
+def get_diarization_pipeline():
+    """Return the shared speaker diarization pipeline, loading it on first use (None if unavailable)"""
+    global _diarization_pipeline, _diarization_loaded
+    with _diarization_lock:
+        if not _diarization_loaded:
+            _diarization_pipeline = _measure("diarization_pipeline", _load_diarization_pipeline)
+            _diarization_loaded = True
+        return _diarization_pipeline
+
+
+# Diarization requests from all sessions are batched onto one thread
+diarization_scheduler = DiarizationScheduler(get_diarization_pipeline)
+
+
+def _load_embedding_model():
+    try:
+        try:
+            from pyannote.audio import Inference, Model
+        except ImportError:
+            from pyannote_audio import Inference, Model
+    except ImportError:
+        print("Warning: Could not import pyannote audio. Speaker embeddings are unavailable.")
+        return None
+    
+    try:
+        hf_token = os.environ.get("HF_TOKEN")
+        if not hf_token:
+            print("Warning: HF_TOKEN not found. Speaker embeddings are unavailable.")
+            return None
+        model = Model.from_pretrained("pyannote/embedding", use_auth_token=hf_token)
+        return Inference(model, window="whole")
+    except Exception as e:
+        print(f"Error loading speaker embedding model: {e}")
+    return None
+
+
+def get_embedding_model():
+    """Return the shared speaker embedding model, loading it on first use (None if unavailable)"""
+    global _embedding_model, _embedding_loaded
+    with _embedding_lock:
+        if not _embedding_loaded:
+            _embedding_model = _measure("embedding_model", _load_embedding_model)
+            _embedding_loaded = True
+        return _embedding_model
+
+
+def warm_up(diarization=True, speech_engine=True, audio_input=False):
+    """
+    Load the voice subsystem ahead of time, e.g. at deploy time, so the
+    first recording doesn't pay for it. Returns the load statistics.
+    """
+    if diarization:
+        get_diarization_pipeline()
+        get_embedding_model()
+    if speech_engine:
+        _measure("stt_engine", stt_engines.get_engine)
+    if audio_input:
+        _lazy_module("pyaudio")
+        _lazy_module("webrtcvad")
+    _lazy_module("pydub")
+    return dict(load_stats)
+
 
+class RecordingBuffer:
+    """
+    Preallocated buffer holding one recording of up to max_seconds of
+    16-bit mono audio. Frames are read straight into it, and utterances,
+    the whole recording and the optional WAV file are all served as views
+    of the same bytes. Views stay valid for as long as the buffer lives.
+    """
 
-class AudioRecorder:
-    def __init__(self, sample_rate=16000, chunk_size=1024):
+    def __init__(self, sample_rate=16000, max_seconds=MAX_RECORDING_SECONDS):
+        self.sample_rate = sample_rate
+        self.sample_width = 2
+        self.buffer = memoryview(bytearray(int(max_seconds * sample_rate) * self.sample_width))
+        self.length = 0  # bytes of recorded audio
+
+    def reserve(self, n):
+        """Return a writable view of the next n bytes, or None once the buffer is full"""
+        if self.length + n > len(self.buffer):
+            return None
+        return self.buffer[self.length:self.length + n]
+
+    def commit(self, n):
+        """Mark n reserved bytes as recorded"""
+        self.length += n
+
+    def view(self, start_time=None, end_time=None):
+        """Return a zero-copy view of the recording, optionally between two timestamps"""
+        start = int((start_time or 0) * self.sample_rate) * self.sample_width
+        end = self.length if end_time is None else min(int(end_time * self.sample_rate) * self.sample_width, self.length)
+        return self.buffer[start:end]
+
+    def audio(self, start_time=None, end_time=None):
+        """The recording, or a stretch of it, as sr.AudioData backed by this buffer"""
+        return sr.AudioData(self.view(start_time, end_time), self.sample_rate, self.sample_width)
+
+    def save_wav(self, path=None):
+        """
+        Write the recording to a WAV file and return its path. Nothing is
+        written unless this is called. Without a path a temporary file is
+        created; the caller removes it.
+        """
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="recording_", suffix=".wav")
+            os.close(fd)
+        with wave.open(path, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(self.sample_width)
+            wf.setframerate(self.sample_rate)
+            wf.writeframes(self.view())
+        return path
+
+
+class AudioRingBuffer:
+    """
+    Fixed-size byte ring buffer between the PyAudio callback and the VAD
+    thread. When the reader falls behind, the oldest audio is overwritten.
+    """
+
+    def __init__(self, capacity):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.capacity = capacity
+        self.read_pos = 0
+        self.size = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def write(self, data):
+        with self.cond:
+            data = memoryview(data)[-self.capacity:]
+            n = len(data)
+            write_pos = (self.read_pos + self.size) % self.capacity
+            first = min(n, self.capacity - write_pos)
+            self.view[write_pos:write_pos + first] = data[:first]
+            self.view[:n - first] = data[first:]
+            overflow = self.size + n - self.capacity
+            if overflow > 0:
+                self.read_pos = (self.read_pos + overflow) % self.capacity
+                self.size = self.capacity
+            else:
+                self.size += n
+            self.cond.notify()
+
+    def read_into(self, out, timeout=None):
+        """
+        Copy the oldest len(out) bytes into the writable buffer `out`.
+        Returns True once filled, False on timeout and None once the buffer
+        is closed and drained.
+        """
+        n = len(out)
+        with self.cond:
+            while self.size < n and not self.closed:
+                if not self.cond.wait(timeout):
+                    return False
+            if self.size < n:
+                return None
+            first = min(n, self.capacity - self.read_pos)
+            out[:first] = self.view[self.read_pos:self.read_pos + first]
+            out[first:] = self.view[:n - first]
+            self.read_pos = (self.read_pos + n) % self.capacity
+            self.size -= n
+            return True
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class StreamingVoicePipeline:
+    """
+    Records from the microphone and transcribes utterance by utterance.
+
+    The PyAudio callback only copies audio into a ring buffer. A worker
+    thread moves it frame by frame into the recording's RecordingBuffer,
+    runs VAD to find where utterances start and end, and hands each
+    finished utterance, a view of the recording, to the transcription
+    pool. Results are passed to `on_segments` in recording order as soon
+    as they are ready. Each utterance is labelled through a SpeakerIndex:
+    voices are enrolled as they are first heard and matched afterwards,
+    so live speech gets the same roommate names as diarized recordings.
+    Without a session index, speakers are called Person 1, Person 2, ...
+    Labels stay "unknown" only if no embedding model is available. After stop(),
+    recording() returns the whole recording, e.g. for
+    process_audio_for_therapy, and save_wav() writes it to disk.
+    """
+
+    def __init__(self, on_segments, sample_rate=16000, chunk_size=1024, speaker_index=None, num_speakers=2):
+        self.on_segments = on_segments
+        if speaker_index is None:
+            from speaker_index import SpeakerIndex
+            speaker_index = SpeakerIndex([f"Person {i + 1}" for i in range(num_speakers)])
+        self.speaker_index = speaker_index
         self.sample_rate = sample_rate
         self.chunk_size = chunk_size
-        self.p = pyaudio.PyAudio()
+        self.vad = _lazy_module("webrtcvad").Vad(VAD_AGGRESSIVENESS)
+        self.frame_bytes = int(sample_rate * VAD_FRAME_MS / 1000) * 2
+        self.ring = AudioRingBuffer(int(sample_rate * RING_BUFFER_SECONDS) * 2)
+        self.buffer = RecordingBuffer(sample_rate)
+        self.pyaudio = None
+        self.p = None
         self.stream = None
-        self.frames = []
-        self.is_recording = False
-        self.temp_dir = tempfile.mkdtemp()
-        
-    def start_recording(self):
-        """Start recording audio"""
-        self.frames = []
-        self.is_recording = True
+        self.thread = None
+        self.pending = deque()  # transcription futures, in recording order
+        self.stopped = threading.Event()
+        self.started_at = None
+
+    def start(self):
+        self.pyaudio = _lazy_module("pyaudio")
+        self.p = self.pyaudio.PyAudio()
         self.stream = self.p.open(
-            format=pyaudio.paInt16,
+            format=self.pyaudio.paInt16,
             channels=1,
             rate=self.sample_rate,
             input=True,
             frames_per_buffer=self.chunk_size,
             stream_callback=self._callback
         )
+        self.thread = threading.Thread(target=self._process, name="vad", daemon=True)
+        self.thread.start()
         self.stream.start_stream()
+        self.started_at = time.perf_counter()
         print("Recording started...")
-        
+
     def _callback(self, in_data, frame_count, time_info, status):
-        """Callback function for audio stream"""
-        self.frames.append(in_data)
-        return (in_data, pyaudio.paContinue)
-    
-    def stop_recording(self):
-        """Stop recording and return the recorded audio"""
-        if not self.is_recording:
-            return None
-            
-        self.is_recording = False
+        self.ring.write(in_data)
+        return (in_data, self.pyaudio.paContinue)
+
+    def stop(self):
+        """Stop recording, finish the current utterance and wait for all transcripts"""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
         if self.stream:
             self.stream.stop_stream()
             self.stream.close()
             self.stream = None
-            
+        if self.p:
+            self.p.terminate()
+            self.p = None
+        self.ring.close()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        if self.started_at is not None:
+            metrics.record("voice.recording", time.perf_counter() - self.started_at)
         print("Recording stopped.")
-        
-        # Save the recorded audio to a temporary WAV file
-        if not self.frames:
-            return None
-            
-        temp_file = os.path.join(self.temp_dir, f"recording_{int(time.time())}.wav")
-        wf = wave.open(temp_file, 'wb')
-        wf.setnchannels(1)
-        wf.setsampwidth(self.p.get_sample_size(pyaudio.paInt16))
-        wf.setframerate(self.sample_rate)
-        wf.writeframes(b''.join(self.frames))
-        wf.close()
-        
-        return temp_file
-    
-    def close(self):
-        """Clean up resources"""
-        if self.stream:
-            self.stream.close()
-        self.p.terminate()
 
+    def recording(self):
+        """The audio recorded so far as sr.AudioData backed by the recording buffer"""
+        return self.buffer.audio()
+
+    def save_wav(self, path=None):
+        """Write the recording to a WAV file and return its path"""
+        return self.buffer.save_wav(path)
+
+    def _process(self):
+        frame_bytes = self.frame_bytes
+        frame_seconds = VAD_FRAME_MS / 1000
+        padding_frames = VAD_PADDING_MS // VAD_FRAME_MS
+        max_frames = max(int(MAX_UTTERANCE_SECONDS / frame_seconds), padding_frames)
+        # Audio read once the recording buffer is full is drained here and dropped
+        overflow = memoryview(bytearray(frame_bytes))
+        recent = deque(maxlen=padding_frames)
+        triggered = False
+        start_frame = 0
+        frame_index = 0
+        limit_reached = False
+
+        while True:
+            frame = self.buffer.reserve(frame_bytes)
+            if frame is None and not limit_reached:
+                # Stop from a separate thread so this one can drain the ring buffer
+                limit_reached = True
+                threading.Thread(target=self.stop, daemon=True).start()
+            filled = self.ring.read_into(frame if frame is not None else overflow, timeout=0.1)
+            self._emit_ready()
+            if filled is None:
+                break
+            if not filled or frame is None:
+                continue
+            self.buffer.commit(frame_bytes)
+            is_speech = self.vad.is_speech(frame, self.sample_rate)
+
+            if not triggered:
+                recent.append(is_speech)
+                # Start an utterance once most of the recent window is speech;
+                # the padding frames before it are already in the buffer
+                if sum(recent) > 0.9 * recent.maxlen:
+                    triggered = True
+                    start_frame = frame_index - len(recent) + 1
+                    recent.clear()
+            else:
+                recent.append(is_speech)
+                # End it once most of the recent window is silence, or it gets too long
+                if sum(not speech for speech in recent) > 0.9 * recent.maxlen or frame_index + 1 - start_frame >= max_frames:
+                    self._transcribe_utterance(start_frame, frame_index + 1)
+                    triggered = False
+                    recent.clear()
+            frame_index += 1
+
+        if triggered and frame_index > start_frame:
+            self._transcribe_utterance(start_frame, frame_index)
+        wait([future for future, _, _ in self.pending], timeout=SEGMENT_TIMEOUT)
+        self._emit_ready(final=True)
 
-def transcribe_audio(audio_file):
-    """Transcribe audio file using Google Speech Recognition"""
+    def _transcribe_utterance(self, start_frame, end_frame):
+        if len(self.pending) >= MAX_PENDING_UTTERANCES:
+            # Workers are saturated: hold this recording back rather than queue without bound.
+            # Meanwhile the ring buffer keeps only the most recent audio.
+            wait([self.pending[0][0]], timeout=SEGMENT_TIMEOUT)
+            self._emit_ready()
+        frame_seconds = VAD_FRAME_MS / 1000
+        start_time = start_frame * frame_seconds
+        end_time = end_frame * frame_seconds
+        audio_data = sr.AudioData(
+            self.buffer.buffer[start_frame * self.frame_bytes:end_frame * self.frame_bytes], self.sample_rate, 2
+        )
+        future = transcribe_pool.submit(self._utterance_job, audio_data)
+        self.pending.append((future, start_time, end_time))
+
+    def _utterance_job(self, audio_data):
+        """Transcribe an utterance and say which roommate spoke it"""
+        text = transcribe_audio(audio_data)
+        speaker = "unknown"
+        if text:
+            embedding = embed_pcm(memoryview(audio_data.frame_data), audio_data.sample_rate, audio_data.sample_width)
+            if embedding is not None and self.speaker_index.ready:
+                speaker = self.speaker_index.classify(embedding)[0]
+            elif embedding is not None and len(audio_data.frame_data) >= MIN_EMBEDDING_SECONDS * audio_data.sample_rate * audio_data.sample_width:
+                # Until every voice is known, each utterance enrolls or refines one
+                speaker = self.speaker_index.assign(embedding)[0]
+        return text, speaker
+
+    def _emit_ready(self, final=False):
+        """Pass on finished transcripts, keeping them in recording order"""
+        while self.pending and (final or self.pending[0][0].done()):
+            future, start_time, end_time = self.pending.popleft()
+            if not future.done() or future.exception() is not None:
+                continue
+            text, speaker = future.result()
+            if text:
+                self.on_segments([{
+                    "speaker": speaker,
+                    "mapped_speaker": speaker,
+                    "start": start_time,
+                    "end": end_time,
+                    "text": text
+                }])
+
+
+@metrics.timed("voice.transcription")
+def transcribe_audio(audio):
+    """
+    Transcribe audio with the configured speech engine (STT_ENGINE).
+    Accepts a WAV file path or an already decoded sr.AudioData.
+    """
     try:
-        with sr.AudioFile(audio_file) as source:
-            audio_data = recognizer.record(source)
-            text = recognizer.recognize_google(audio_data)
-            return text
-    except sr.UnknownValueError:
-        return ""
+        if isinstance(audio, sr.AudioData):
+            audio_data = audio
+        else:
+            with sr.AudioFile(audio) as source:
+                audio_data = sr.Recognizer().record(source)
+        return stt_engines.get_engine().transcribe(audio_data)
     except sr.RequestError as e:
-        print(f"Could not request results from Google Speech Recognition service; {e}")
+        print(f"Could not request results from the speech recognition service; {e}")
         return ""
 
 
-def identify_speakers(audio_file):
+@metrics.timed("voice.transcription_batch")
+def transcribe_batch(audio_list):
+    """Transcribe several sr.AudioData in one engine call where the engine supports it"""
+    try:
+        return stt_engines.get_engine().transcribe_batch(audio_list)
+    except sr.RequestError as e:
+        print(f"Could not request results from the speech recognition service; {e}")
+        return [""] * len(audio_list)
+
+
+def load_pcm(audio):
     """
-    Identify different speakers in the audio file using pyannote.audio
-    Returns a list of segments with speaker labels and timestamps
+    Decode a WAV file once into mono 16-bit PCM, or wrap mono sr.AudioData,
+    converting it only if it isn't 16-bit already.
+    Returns (memoryview of the samples, sample rate, sample width in bytes).
     """
-    if diarization_pipeline is None:
-        # Fallback to a simpler method if diarization is not available
-        return [{"speaker": "unknown", "text": transcribe_audio(audio_file)}]
+    if isinstance(audio, sr.AudioData):
+        if audio.sample_width == 2:
+            return memoryview(audio.frame_data), audio.sample_rate, 2
+        return memoryview(audio.get_raw_data(convert_width=2)), audio.sample_rate, 2
+    audio = _lazy_module("pydub").AudioSegment.from_wav(audio).set_channels(1).set_sample_width(2)
+    return memoryview(audio.raw_data), audio.frame_rate, audio.sample_width
+
+
+def _diarization_input(pcm, sample_rate, sample_width):
+    """Wrap decoded 16-bit PCM as the in-memory waveform pyannote accepts"""
+    np = _lazy_module("numpy")
+    torch = _lazy_module("torch")
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    return {"waveform": torch.from_numpy(samples).unsqueeze(0), "sample_rate": sample_rate}
+
+
+def embed_pcm(pcm, sample_rate, sample_width, start_time=None, end_time=None):
+    """Return the speaker embedding of a stretch of PCM audio, or None if unavailable"""
+    model = get_embedding_model()
+    if model is None:
+        return None
+    if start_time is not None:
+        start = int(start_time * sample_rate) * sample_width
+        end = int(end_time * sample_rate) * sample_width
+        pcm = pcm[start:end]
+    return _lazy_module("numpy").asarray(model(_diarization_input(pcm, sample_rate, sample_width))).ravel()
+
+
+def speaker_embeddings(pcm, sample_rate, sample_width, segments):
+    """
+    Compute one embedding per diarized speaker: the duration-weighted mean
+    of the embeddings of their turns. Returns {speaker label: embedding}.
+    """
+    np = _lazy_module("numpy")
+    sums = {}
+    for segment in segments:
+        duration = segment["end"] - segment["start"]
+        if duration < MIN_EMBEDDING_SECONDS:
+            continue
+        embedding = embed_pcm(pcm, sample_rate, sample_width, segment["start"], segment["end"])
+        if embedding is None:
+            return {}
+        total, weight = sums.get(segment["speaker"], (0, 0.0))
+        sums[segment["speaker"]] = (total + embedding * duration, weight + duration)
+    return {speaker: total / weight for speaker, (total, weight) in sums.items() if np.any(total)}
+
+
+@metrics.timed("voice.classification")
+def classify_speakers(audio, index):
+    """
+    Cheaper alternative to full diarization once both voices are known:
+    label fixed windows by their nearest roommate, merge neighbouring
+    windows into turns, then transcribe the turns.
+    """
+    np = _lazy_module("numpy")
+    pcm, sample_rate, sample_width = load_pcm(audio)
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    window = int(CLASSIFY_WINDOW_SECONDS * sample_rate)
     
-    try:
-        # Run diarization
-        diarization = diarization_pipeline(audio_file)
-        
-        # Extract segments
-        segments = []
-        for turn, _, speaker in diarization.itertracks(yield_label=True):
-            # Get audio segment
-            start_time = turn.start
-            end_time = turn.end
-            
-            # Create a temporary file for this segment
-            temp_segment = os.path.join(os.path.dirname(audio_file), f"segment_{speaker}_{start_time}_{end_time}.wav")
-            
-            # Extract segment from original audio
-            audio = AudioSegment.from_wav(audio_file)
-            segment_audio = audio[start_time*1000:end_time*1000]
-            segment_audio.export(temp_segment, format="wav")
-            
-            # Transcribe segment
-            text = transcribe_audio(temp_segment)
-            
+    windows = []
+    embeddings = []
+    for start in range(0, len(samples), window):
+        chunk = samples[start:start + window]
+        if len(chunk) < MIN_EMBEDDING_SECONDS * sample_rate:
+            continue
+        if np.sqrt(np.mean((chunk / 32768.0) ** 2)) < SILENCE_RMS:
+            continue
+        embedding = embed_pcm(pcm, sample_rate, sample_width, start / sample_rate, (start + len(chunk)) / sample_rate)
+        if embedding is None:
+            return None
+        windows.append((start / sample_rate, (start + len(chunk)) / sample_rate))
+        embeddings.append(embedding)
+    
+    if not embeddings:
+        return []
+    
+    # Merge consecutive windows from the same roommate into one turn
+    turns = []
+    for (start_time, end_time), name in zip(windows, index.classify(np.vstack(embeddings))):
+        if turns and turns[-1][2] == name and abs(turns[-1][1] - start_time) < 1e-6:
+            turns[-1] = (turns[-1][0], end_time, name)
+        else:
+            turns.append((start_time, end_time, name))
+    
+    segments = transcribe_segments(pcm, sample_rate, sample_width, turns)
+    for segment in segments:
+        segment["mapped_speaker"] = segment["speaker"]
+    return segments
+
+
+def slice_audio(pcm, sample_rate, sample_width, start_time, end_time):
+    """Return the audio between two timestamps as sr.AudioData, without copying the samples"""
+    start = int(start_time * sample_rate) * sample_width
+    end = int(end_time * sample_rate) * sample_width
+    return sr.AudioData(pcm[start:end], sample_rate, sample_width)
+
+
+def transcribe_segments(pcm, sample_rate, sample_width, turns):
+    """
+    Transcribe diarized turns concurrently on the shared worker pool, in
+    batches when the engine supports it. `turns` is a list of
+    (start, end, speaker); returns segments with text, in timestamp order.
+    Each batch gets SEGMENT_TIMEOUT per segment from when a worker picks
+    it up, so time spent queued behind other sessions doesn't count.
+    Segments that time out or fail are left out.
+    """
+    turns = sorted(turns, key=lambda turn: turn[0])
+    batch_size = max(stt_engines.get_engine().batch_size, 1)
+    batches = [turns[i:i + batch_size] for i in range(0, len(turns), batch_size)]
+    started = [None] * len(batches)
+    
+    def run(index, audio_list):
+        started[index] = time.monotonic()
+        return transcribe_batch(audio_list)
+    
+    futures = [
+        transcribe_pool.submit(
+            run, index,
+            [slice_audio(pcm, sample_rate, sample_width, start, end) for start, end, _ in batch]
+        )
+        for index, batch in enumerate(batches)
+    ]
+    
+    pending = set(range(len(futures)))
+    timed_out = 0
+    while pending:
+        now = time.monotonic()
+        remaining = {}
+        for index in list(pending):
+            if futures[index].done():
+                pending.discard(index)
+            elif started[index] is not None:
+                remaining[index] = started[index] + SEGMENT_TIMEOUT * len(batches[index]) - now
+                if remaining[index] <= 0:
+                    # A running call can't be cancelled; its result is simply ignored
+                    pending.discard(index)
+                    timed_out += 1
+        if not pending:
+            break
+        # Wake for the next deadline, or shortly to see whether a queued batch has started
+        timeout = min([remaining[index] for index in pending if index in remaining] + [0.25])
+        wait([futures[index] for index in pending], timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+    if timed_out:
+        print(f"Warning: {timed_out} batch(es) of segments timed out during transcription")
+    
+    segments = []
+    for batch, future in zip(batches, futures):
+        if not future.done() or future.exception() is not None:
+            continue
+        for (start_time, end_time, speaker), text in zip(batch, future.result()):
             if text:
                 segments.append({
                     "speaker": speaker,
@@ -164,24 +658,60 @@ def identify_speakers(audio_file):
                     "end": end_time,
                     "text": text
                 })
-            
-            # Clean up temporary file
-            os.remove(temp_segment)
-            
+    return segments
+
+
+def identify_speakers(audio):
+    """
+    Identify different speakers in the audio using pyannote.audio.
+    `audio` is a WAV file path or sr.AudioData.
+    Returns a list of segments with speaker labels and timestamps
+    """
+    diarization_pipeline = get_diarization_pipeline()
+    if diarization_pipeline is None:
+        # Fallback to a simpler method if diarization is not available
+        return [{"speaker": "unknown", "text": transcribe_audio(audio)}]
+    
+    try:
+        # Decode the recording once; diarization and every turn share the buffer
+        pcm, sample_rate, sample_width = load_pcm(audio)
+        
+        # Run diarization, batched with recordings from other sessions
+        diarization = diarization_scheduler.diarize(_diarization_input(pcm, sample_rate, sample_width))
+        
+        # Transcribe all turns in parallel
+        turns = [(turn.start, turn.end, speaker) for turn, _, speaker in diarization.itertracks(yield_label=True)]
+        segments = transcribe_segments(pcm, sample_rate, sample_width, turns)
+        
         return segments
     except Exception as e:
         print(f"Error in speaker identification: {e}")
-        return [{"speaker": "unknown", "text": transcribe_audio(audio_file)}]
+        return [{"speaker": "unknown", "text": transcribe_audio(audio)}]
 
 
-def process_audio_for_therapy(audio_file):
+@metrics.timed("voice.process")
+def process_audio_for_therapy(audio, speaker_index=None, num_speakers=2):
     """
-    Process audio file for therapy session:
+    Process audio (a WAV file path or sr.AudioData) for therapy session:
     1. Identify speakers
     2. Transcribe what each speaker said
     3. Return structured data for the therapy bot
+    
+    With a per-session SpeakerIndex, speakers are mapped to the same
+    roommate names across recordings, and once both voices are known the
+    full diarization step is skipped.
     """
-    segments = identify_speakers(audio_file)
+    if speaker_index is not None and not isinstance(audio, sr.AudioData):
+        # Classification, diarization and speaker embeddings all read the
+        # samples; decode the file once and let every step share them
+        audio = sr.AudioData(*load_pcm(audio))
+    
+    if speaker_index is not None and speaker_index.ready:
+        segments = classify_speakers(audio, speaker_index)
+        if segments is not None:
+            return segments
+    
+    segments = identify_speakers(audio)
     
     # If we only have one segment with unknown speaker, try to split by silence
     if len(segments) == 1 and segments[0]["speaker"] == "unknown":
@@ -189,19 +719,27 @@ def process_audio_for_therapy(audio_file):
         # Very basic attempt to split by natural pauses
         sentences = text.split('. ')
         if len(sentences) > 1:
-            # Alternate speakers for sentences
+            # Rotate through the roommates sentence by sentence
             new_segments = []
             for i, sentence in enumerate(sentences):
                 if not sentence.strip():
                     continue
                 new_segments.append({
-                    "speaker": f"Speaker {i % 2 + 1}",
+                    "speaker": f"Speaker {i % num_speakers + 1}",
                     "text": sentence.strip()
                 })
             segments = new_segments
     
-    # Map speakers to Person 1 and Person 2
+    # Map diarized speakers to roommates by voice when we can
     speaker_mapping = {}
+    if speaker_index is not None and segments and "start" in segments[0]:
+        pcm, sample_rate, sample_width = load_pcm(audio)
+        embeddings = speaker_embeddings(pcm, sample_rate, sample_width, segments)
+        if embeddings:
+            names = speaker_index.assign(list(embeddings.values()))
+            speaker_mapping = dict(zip(embeddings.keys(), names))
+    
+    # Otherwise map speakers to Person 1, Person 2, ...
     for segment in segments:
         speaker = segment["speaker"]
         if speaker not in speaker_mapping:
@@ -214,56 +752,5 @@ def process_audio_for_therapy(audio_file):
     return segments
 
 
-def start_voice_recording():
-    """Start recording voice in a separate thread"""
-    global is_recording
-    
-    if is_recording:
-        return False
-    
-    is_recording = True
-    recorder = AudioRecorder()
-    
-    def record_thread():
-        global is_recording
-        recorder.start_recording()
-        
-        # Record for a maximum of 60 seconds
-        max_time = 60
-        start_time = time.time()
-        
-        while is_recording and (time.time() - start_time) < max_time:
-            time.sleep(0.1)
-        
-        audio_file = recorder.stop_recording()
-        recorder.close()
-        
-        if audio_file:
-            # Process the audio file
-            segments = process_audio_for_therapy(audio_file)
-            
-            # Put the processed segments in the queue
-            audio_queue.put(segments)
-            
-            # Clean up the audio file
-            os.remove(audio_file)
-        
-        is_recording = False
-    
-    # Start recording in a separate thread
-    threading.Thread(target=record_thread).start()
-    return True
-
-
-def stop_voice_recording():
-    """Stop the current voice recording"""
-    global is_recording
-    is_recording = False
-    return True
-
-
-def get_processed_voice():
-    """Get processed voice data if available"""
-    if not audio_queue.empty():
-        return audio_queue.get()
-    return None
+# Import time of this module itself, without the lazily loaded components
+load_stats["voice_recognition_import"] = {"seconds": time.perf_counter() - _import_started, "rss_mb": 0.0}
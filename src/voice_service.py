@@ -0,0 +1,207 @@
+import os
+import queue
+import threading
+import metrics
+import session_store
+import voice_recognition
+from speaker_index import SpeakerIndex
+
+# Worker threads running diarization and transcription for all sessions
+VOICE_WORKERS = int(os.environ.get("VOICE_WORKERS", "2"))
+# Recordings waiting for a worker; beyond this, submit() pushes back
+VOICE_QUEUE_SIZE = int(os.environ.get("VOICE_QUEUE_SIZE", "16"))
+# Seconds submit() waits for room in the queue before giving up
+SUBMIT_TIMEOUT = float(os.environ.get("VOICE_SUBMIT_TIMEOUT", "2"))
+
+
+class VoiceServiceBusy(Exception):
+    """Raised when the job queue stays full, so the caller can ask the user to retry"""
+
+
+class VoiceSession:
+    """
+    Voice state for one chat session: its recording, its speaker index and
+    the channel its transcribed segments arrive on. Nothing here is shared
+    with other sessions.
+    """
+
+    def __init__(self, service, session_id, names=None):
+        self.service = service
+        self.session_id = session_id
+        self.results = queue.Queue()
+        self.speaker_index = SpeakerIndex(names) if names else None
+        self.pipeline = None
+        self.last_pipeline = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_recording(self):
+        return self.pipeline is not None
+
+    def start_recording(self):
+        """
+        Start streaming voice recording. Each utterance is transcribed as soon
+        as it ends and its segments are pushed to this session's results.
+        """
+        with self.lock:
+            if self.pipeline is not None:
+                return False
+            self.pipeline = voice_recognition.StreamingVoicePipeline(
+                on_segments=self.deliver,
+                speaker_index=self.speaker_index
+            )
+            # Keep the voices enrolled during this recording for the next ones
+            self.speaker_index = self.pipeline.speaker_index
+            self.pipeline.start()
+            return True
+
+    def stop_recording(self):
+        """Stop the current recording, waiting for its last transcripts"""
+        with self.lock:
+            pipeline, self.pipeline = self.pipeline, None
+        if pipeline is not None:
+            pipeline.stop()
+            self.last_pipeline = pipeline
+        return True
+
+    def recording(self):
+        """
+        The last finished recording as sr.AudioData (a view of its buffer),
+        or None. Pass it to submit() to diarize the whole recording.
+        """
+        pipeline = self.last_pipeline
+        return pipeline.recording() if pipeline is not None else None
+
+    def save_recording(self, path=None):
+        """Write the last finished recording to a WAV file and return its path, or None"""
+        pipeline = self.last_pipeline
+        return pipeline.save_wav(path) if pipeline is not None else None
+
+    def submit(self, audio):
+        """Queue a finished recording (WAV path or sr.AudioData) for diarization and transcription"""
+        self.service.submit(self, audio)
+
+    def deliver(self, segments):
+        """Hand transcribed segments to the session and keep them with its transcript"""
+        try:
+            session_store.get_store().append_voice_segments(self.session_id, segments)
+        except Exception as e:
+            print(f"Error storing voice segments for session {self.session_id}: {e}")
+        self.results.put(segments)
+
+    def get_processed_voice(self):
+        """Get processed voice data if available"""
+        try:
+            return self.results.get_nowait()
+        except queue.Empty:
+            return None
+
+
+class VoiceService:
+    """
+    Process-wide voice processing shared by all sessions.
+
+    Whole recordings go through a bounded job queue served by a fixed set
+    of worker threads; each job's segments are delivered to the session
+    that submitted it. Streaming utterances use the shared transcription
+    pool in voice_recognition.
+    """
+
+    def __init__(self, workers=VOICE_WORKERS, queue_size=VOICE_QUEUE_SIZE):
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.closed = False
+        self.workers = [
+            threading.Thread(target=self._work, name=f"voice-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def session(self, session_id, names=None):
+        """Return the voice session for a chat session, creating it on first use"""
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Voice service is shut down")
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = VoiceSession(self, session_id, names)
+            elif names and session.speaker_index is not None:
+                session.speaker_index.rename(names)
+            elif names:
+                session.speaker_index = SpeakerIndex(names)
+            return session
+
+    def close_session(self, session_id):
+        """Stop a session's recording and forget it"""
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.stop_recording()
+        metrics.forget_session(session_id)
+
+    def submit(self, session, audio, timeout=SUBMIT_TIMEOUT):
+        """Queue a recording, raising VoiceServiceBusy if the workers can't keep up"""
+        if self.closed:
+            raise RuntimeError("Voice service is shut down")
+        try:
+            self.jobs.put((session, audio), timeout=timeout)
+        except queue.Full:
+            raise VoiceServiceBusy(f"{self.jobs.qsize()} recordings are already waiting to be processed")
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                session, audio = job
+                metrics.set_session(session.session_id)
+                try:
+                    index = session.speaker_index
+                    segments = voice_recognition.process_audio_for_therapy(
+                        audio, speaker_index=index, num_speakers=len(index.names) if index is not None else 2
+                    )
+                except Exception as e:
+                    print(f"Error processing recording for session {session.session_id}: {e}")
+                    continue
+                if segments:
+                    session.deliver(segments)
+            finally:
+                metrics.set_session(None)
+                self.jobs.task_done()
+
+    def shutdown(self, wait=True):
+        """Stop all recordings, let queued jobs finish and stop the workers"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.stop_recording()
+        for _ in self.workers:
+            self.jobs.put(None)
+        if wait:
+            for worker in self.workers:
+                worker.join()
+
+
+_service = None
+_lock = threading.Lock()
+
+
+def get_service():
+    """Return the process-wide voice service, starting its workers on first use"""
+    global _service
+    with _lock:
+        if _service is None or _service.closed:
+            _service = VoiceService()
+        return _service
+
+
+def get_session(session_id, names=None):
+    """Return the voice session for a chat session on the process-wide service"""
+    return get_service().session(session_id, names)